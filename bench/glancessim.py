@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+#
+# CheckGlances benchmark
+# Local Glances server simulator (XML-RPC and REST API)
+#
+# Copyright (C) Nicolargo 2012 <nicolas@nicolargo.com>
+#
+# This script is distributed
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This script is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.";
+#
+# Syntax: glancessim.py [-B <bind>] [-p <port>] [-P <password>] [--api <xmlrpc|rest>]
+#                       [--interfaces <n>] [--disks <n>] [--mounts <n>] [--processes <n>]
+#                       [--containers <n>] [--cores <n>] [--multicall]
+#                       [--glances-version <version>] [--latency <ms>] [--jitter <ms>]
+#                       [--error-rate <ratio>] [--drop-rate <ratio>] [--hang-rate <ratio>]
+#                       [--hang <seconds>] [--seed <seed>]
+#   Synthetic responses for all the methods used by checkglances.py:
+#     interfaces eth0, eth1..., disks sda, sdb..., mounts /, /mnt/vol1...,
+#     containers container0, container1...
+#   Faults, for each HTTP request:
+#     latency: response delay (+/- jitter)
+#     error-rate: HTTP 500
+#     drop-rate: connection closed without response
+#     hang-rate: no response for --hang seconds (default 120)
+#
+
+import sys
+import json
+import time
+import random
+import getopt
+import socket
+import SocketServer
+import BaseHTTPServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+# Glances plugin behind each XML-RPC method
+methodsplugins = {'getSystem': 'system',
+                  'getUptime': 'uptime',
+                  'getCpu': 'cpu',
+                  'getPerCpu': 'percpu',
+                  'getCore': 'core',
+                  'getLoad': 'load',
+                  'getMem': 'mem',
+                  'getMemSwap': 'memswap',
+                  'getProcessCount': 'processcount',
+                  'getNetwork': 'network',
+                  'getDiskIO': 'diskio',
+                  'getFs': 'fs',
+                  'getProcessList': 'processlist',
+                  'getDocker': 'docker'}
+
+
+def diskname(i):
+    """
+    0 => sda, 25 => sdz, 26 => sdaa...
+    """
+    letters = ""
+    i += 1
+    while i > 0:
+        i, r = divmod(i - 1, 26)
+        letters = chr(ord('a') + r) + letters
+    return "sd" + letters
+
+
+def generate(interfaces = 2, disks = 2, mounts = 3, processes = 200, containers = 5, cores = 4,
+             seed = 0):
+    """
+    Return the synthetic Glances stats {plugin: stats}
+    """
+    r = random.Random(seed)
+    gb = 1024 ** 3
+    stats = {}
+    stats['system'] = {"os_name": "Linux", "hostname": "glancessim", "platform": "64bit",
+                       "linux_distro": "Debian GNU/Linux 9.4", "os_version": "4.9.0-6-amd64",
+                       "hr_name": "Debian GNU/Linux 9.4 64bit"}
+    stats['uptime'] = "12 days, 3:04:05"
+    user, system, iowait = r.uniform(5, 60), r.uniform(1, 15), r.uniform(0, 5)
+    stats['cpu'] = {"total": user + system + iowait, "user": user, "system": system,
+                    "iowait": iowait, "idle": 100 - user - system - iowait, "nice": 0.0,
+                    "irq": 0.0, "softirq": 0.1, "steal": 0.0, "guest": 0.0,
+                    "guest_nice": 0.0, "ctx_switches": 10234, "interrupts": 5120,
+                    "soft_interrupts": 3410, "syscalls": 0, "time_since_update": 2.0,
+                    "cpucore": cores}
+    percpu = []
+    for i in range(cores):
+        user, system = r.uniform(0, 70), r.uniform(0, 20)
+        percpu.append({"cpu_number": i, "total": user + system, "user": user, "system": system,
+                       "idle": 100 - user - system, "nice": 0.0, "iowait": 0.0, "irq": 0.0,
+                       "softirq": 0.0, "steal": 0.0, "guest": 0.0, "guest_nice": 0.0,
+                       "key": "cpu_number"})
+    stats['percpu'] = percpu
+    stats['core'] = {"phys": max(1, cores // 2), "log": cores}
+    stats['load'] = {"min1": r.uniform(0, cores), "min5": r.uniform(0, cores),
+                     "min15": r.uniform(0, cores), "cpucore": cores}
+    used = r.randint(2 * gb, 14 * gb)
+    stats['mem'] = {"total": 16 * gb, "available": 16 * gb - used, "percent": 100.0 * used / (16 * gb),
+                    "used": used, "free": 16 * gb - used, "active": used // 2,
+                    "inactive": used // 4, "buffers": 300 * 1024 ** 2, "cached": 2 * gb}
+    used = r.randint(0, gb)
+    stats['memswap'] = {"total": 4 * gb, "used": used, "free": 4 * gb - used,
+                        "percent": 100.0 * used / (4 * gb), "sin": 0, "sout": 0,
+                        "time_since_update": 2.0}
+    running = r.randint(1, 5)
+    stats['processcount'] = {"total": processes, "running": running,
+                             "sleeping": processes - running, "thread": processes * 3}
+    network = []
+    for i in range(interfaces):
+        rx, tx = r.randint(0, 10 ** 7), r.randint(0, 10 ** 7)
+        network.append({"interface_name": "eth%d" % i, "time_since_update": 2.0,
+                        "rx": rx, "tx": tx, "cx": rx + tx,
+                        "cumulative_rx": rx * 1000, "cumulative_tx": tx * 1000,
+                        "cumulative_cx": (rx + tx) * 1000, "is_up": True,
+                        "speed": 10 ** 9, "key": "interface_name"})
+    stats['network'] = network
+    diskio = []
+    for i in range(disks):
+        diskio.append({"disk_name": diskname(i), "time_since_update": 2.0,
+                       "read_count": r.randint(0, 1000), "write_count": r.randint(0, 1000),
+                       "read_bytes": r.randint(0, 10 ** 8), "write_bytes": r.randint(0, 10 ** 8),
+                       "key": "disk_name"})
+    stats['diskio'] = diskio
+    fs = []
+    for i in range(mounts):
+        size = r.randint(10, 2000) * gb
+        used = int(size * r.uniform(0.05, 0.95))
+        fs.append({"mnt_point": "/mnt/vol%d" % i if i else "/",
+                   "device_name": "/dev/%s1" % diskname(i), "fs_type": "ext4",
+                   "size": size, "used": used, "free": size - used,
+                   "percent": round(100.0 * used / size, 1), "key": "mnt_point"})
+    stats['fs'] = fs
+    processlist = []
+    for i in range(processes):
+        rb, wb = r.randint(0, 10 ** 6), r.randint(0, 10 ** 6)
+        processlist.append({"pid": i + 1, "name": "process%d" % (i + 1),
+                            "cmdline": ["/usr/bin/process%d" % (i + 1), "--option"],
+                            "username": "root", "status": "S", "nice": 0,
+                            "num_threads": r.randint(1, 20),
+                            "cpu_percent": round(r.expovariate(1 / 2.0), 1),
+                            "memory_percent": round(r.expovariate(1 / 0.5), 2),
+                            "memory_info": [r.randint(10 ** 6, 10 ** 9), r.randint(10 ** 7, 10 ** 10)],
+                            "cpu_times": [r.uniform(0, 1000), r.uniform(0, 100)],
+                            "io_counters": [rb * 2, wb * 2, rb, wb, 1],
+                            "time_since_update": 2.0, "key": "pid"})
+    stats['processlist'] = processlist
+    docker = []
+    for i in range(containers):
+        limit = r.choice((512, 1024, 4096)) * 1024 ** 2
+        usage = int(limit * r.uniform(0.05, 0.95))
+        docker.append({"Id": "%064x" % r.getrandbits(256), "name": "container%d" % i,
+                       "Image": ["debian:stretch"], "Status": "running",
+                       "Command": ["/bin/sh", "-c", "sleep infinity"],
+                       "cpu": {"total": round(r.expovariate(1 / 10.0), 2)},
+                       "memory": {"usage": usage, "limit": limit, "max_usage": usage},
+                       "io": {}, "network": {}, "key": "name"})
+    stats['docker'] = {"version": {"Version": "18.03.1-ce", "ApiVersion": "1.37"},
+                       "containers": docker}
+    return stats
+
+
+class simulator(object):
+    """
+    Glances responses (serialized once) and fault injection
+    """
+
+    def __init__(self, stats, password = '', version = "2.11.1", latency = 0, jitter = 0,
+                 errorrate = 0, droprate = 0, hangrate = 0, hang = 120, seed = 0):
+        self.stats = stats
+        self.responses = dict((plugin, json.dumps(s)) for plugin, s in stats.items())
+        self.responses['all'] = json.dumps(stats)
+        self.responses['pluginslist'] = json.dumps(sorted(stats))
+        self.password = password
+        self.version = version
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrate = errorrate
+        self.droprate = droprate
+        self.hangrate = hangrate
+        self.hang = hang
+        self.random = random.Random(seed)
+
+
+    def fault(self):
+        """
+        Wait the response delay, return the fault to inject:
+        None, 'error', 'drop' or 'hang'
+        """
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if (delay > 0):
+            time.sleep(delay / 1000.0)
+        draw = self.random.random()
+        for fault, rate in (('error', self.errorrate), ('drop', self.droprate),
+                            ('hang', self.hangrate)):
+            if (draw < rate):
+                return fault
+            draw -= rate
+        return None
+
+
+    def authorized(self, header):
+        if (self.password == ''):
+            return True
+        import base64
+        return header == 'Basic ' + base64.b64encode('glances:%s' % self.password)
+
+
+    def select(self, plugin, key, value):
+        """
+        REST selection: {value: [items whose key is value]}, None if no item
+        """
+        if not isinstance(self.stats.get(plugin), list):
+            return None
+        items = [s for s in self.stats[plugin] if str(s.get(key)) == value]
+        if not items:
+            return None
+        return json.dumps({value: items})
+
+
+class glancesinstance(object):
+    """
+    XML-RPC methods of the Glances server
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+
+    def _listMethods(self):
+        return ['init', 'getAll', 'getAllPlugins'] + sorted(methodsplugins)
+
+
+    def _dispatch(self, method, params):
+        if (method == 'init'):
+            return self.simulator.version
+        if (method == 'getAll'):
+            return self.simulator.responses['all']
+        if (method == 'getAllPlugins'):
+            return self.simulator.responses['pluginslist']
+        if method in methodsplugins:
+            return self.simulator.responses[methodsplugins[method]]
+        raise Exception('method "%s" is not supported' % method)
+
+
+def injectfault(handler, simulator):
+    """
+    Apply the fault of this request
+    Return True if the request has been answered (or dropped)
+    """
+    fault = simulator.fault()
+    if (fault == 'hang'):
+        time.sleep(simulator.hang)
+        fault = 'drop'
+    if (fault == 'drop'):
+        handler.close_connection = 1
+        handler.connection.shutdown(socket.SHUT_RDWR)
+        return True
+    if (fault == 'error'):
+        handler.send_error(500, "Injected error")
+        return True
+    if not simulator.authorized(handler.headers.get('Authorization')):
+        handler.send_response(401)
+        handler.send_header('WWW-Authenticate', 'Basic realm="glances"')
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
+        return True
+    return False
+
+
+class xmlrpchandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/RPC2',)
+
+    def do_POST(self):
+        if not injectfault(self, self.server.simulator):
+            SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class xmlrpcserver(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class resthandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        simulator = self.server.simulator
+        if injectfault(self, simulator):
+            return
+        import urllib
+        parts = [urllib.unquote(p) for p in self.path.split('?')[0].split('/')[3:]]
+        body = None
+        if (self.path.startswith('/api/')) and (len(parts) == 1):
+            body = simulator.responses.get(parts[0])
+        elif (self.path.startswith('/api/')) and (len(parts) == 3):
+            body = simulator.select(parts[0], parts[1], parts[2])
+        if body is None:
+            self.send_error(404, "Unknown plugin or item")
+            return
+        self.send_response(200)
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            import zlib
+            compress = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compress.compress(body) + compress.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class restserver(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def server(simulator, bind = "127.0.0.1", port = 61209, api = 'xmlrpc', multicall = False):
+    """
+    Return the simulator server (not started, see serve_forever())
+    """
+    if (api == 'rest'):
+        s = restserver((bind, port), resthandler)
+    else:
+        s = xmlrpcserver((bind, port), xmlrpchandler, logRequests = False, allow_none = True)
+        s.register_introspection_functions()
+        if multicall:
+            s.register_multicall_functions()
+        s.register_instance(glancesinstance(simulator))
+    s.simulator = simulator
+    return s
+
+
+def main():
+    bind = "127.0.0.1"
+    port = None
+    password = ''
+    api = 'xmlrpc'
+    sizes = {}
+    faults = {}
+    multicall = False
+    version = "2.11.1"
+    seed = 0
+    opts, args = getopt.getopt(sys.argv[1:], "B:p:P:",
+                               ["api=", "interfaces=", "disks=", "mounts=", "processes=",
+                                "containers=", "cores=", "multicall", "glances-version=", "latency=",
+                                "jitter=", "error-rate=", "drop-rate=", "hang-rate=",
+                                "hang=", "seed="])
+    for opt, arg in opts:
+        if opt == "-B":
+            bind = arg
+        elif opt == "-p":
+            port = int(arg)
+        elif opt == "-P":
+            password = arg
+        elif opt == "--api":
+            api = arg
+        elif opt in ("--interfaces", "--disks", "--mounts", "--processes", "--containers",
+                     "--cores"):
+            sizes[opt[2:]] = int(arg)
+        elif opt == "--multicall":
+            multicall = True
+        elif opt == "--glances-version":
+            version = arg
+        elif opt in ("--latency", "--jitter", "--hang"):
+            faults[opt[2:]] = float(arg)
+        elif opt in ("--error-rate", "--drop-rate", "--hang-rate"):
+            faults[opt[2:].replace("-", "")] = float(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+    if port is None:
+        port = 61208 if (api == 'rest') else 61209
+
+    s = server(simulator(generate(seed = seed, **sizes), password, version, seed = seed, **faults),
+               bind, port, api, multicall)
+    sys.stderr.write("Glances %s simulator (%s) on %s:%d\n" % (version, api, bind, port))
+    try:
+        s.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# CheckGlances startup benchmark
+# Wall time and peak RSS of one plugin run, per stat
+#
+# Copyright (C) Nicolargo 2012 <nicolas@nicolargo.com>
+#
+# This script is distributed
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This script is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.";
+#
+# Syntax: startup.py [-H <host>] [-p <port>] [-n <runs>] [-i <python>] [-e <entry>]
+#   cold: first run, without compiled plugin and without cache directory
+#   warm: median and minimum of the next runs
+#   rss: peak resident memory of the runs (KB)
+#
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+
+# Stats and their plugin options
+stats = (('version', ['-V']),
+         ('system', ['-s', 'system']),
+         ('uptime', ['-s', 'uptime']),
+         ('cpu', ['-s', 'cpu']),
+         ('load', ['-s', 'load']),
+         ('mem', ['-s', 'mem']),
+         ('swap', ['-s', 'swap']),
+         ('process', ['-s', 'process']),
+         ('net', ['-s', 'net', '-e', 'eth0']),
+         ('diskio', ['-s', 'diskio', '-e', 'sda']),
+         ('fs', ['-s', 'fs', '-e', '/']),
+         ('all', ['-s', 'all']))
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(command, env):
+    """
+    Run command, return its (wall time in seconds, peak RSS in KB)
+    """
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        try:
+            os.execve(command[0], command, env)
+        finally:
+            os._exit(127)
+    pid, status, rusage = os.wait4(pid, 0)
+    return (time.time() - start, rusage.ru_maxrss)
+
+
+def main():
+    host = "localhost"
+    port = "61209"
+    runs = 20
+    python = sys.executable
+    entry = "checkglances.py"
+    opts, args = getopt.getopt(sys.argv[1:], "H:p:n:i:e:")
+    for opt, arg in opts:
+        if opt == "-H":
+            host = arg
+        elif opt == "-p":
+            port = arg
+        elif opt == "-n":
+            runs = int(arg)
+        elif opt == "-i":
+            python = arg
+        elif opt == "-e":
+            entry = arg
+
+    cachedir = tempfile.mkdtemp(prefix = "checkglances-bench-")
+    env = dict(os.environ)
+    env["TMPDIR"] = cachedir
+    print("%s %s -H %s -p %s, %d runs" % (python, entry, host, port, runs))
+    print("%-10s %10s %10s %10s %10s" % ("stat", "cold ms", "warm ms", "min ms", "rss KB"))
+    try:
+        for name, options in stats:
+            command = [python, os.path.join(root, entry), "-H", host, "-p", port] + options
+            # Cold: no compiled plugin, no server metadata
+            for compiled in ("checkglances.pyc", "checkglances.pyo"):
+                if os.path.exists(os.path.join(root, compiled)):
+                    os.unlink(os.path.join(root, compiled))
+            shutil.rmtree(os.path.join(cachedir, "checkglances-cache"), ignore_errors = True)
+            cold, rss = run(command, env)
+            warm = []
+            for i in range(runs):
+                wall, maxrss = run(command, env)
+                warm.append(wall)
+                rss = max(rss, maxrss)
+            warm.sort()
+            print("%-10s %10.1f %10.1f %10.1f %10d" % (
+                name, cold * 1000, warm[len(warm) // 2] * 1000, warm[0] * 1000, rss))
+    finally:
+        shutil.rmtree(cachedir, ignore_errors = True)
+
+
+if __name__ == "__main__":
+    main()
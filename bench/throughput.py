@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#
+# CheckGlances throughput benchmark
+# Checks per second, latency and peak RSS per stat and number of hosts
+#
+# Copyright (C) Nicolargo 2012 <nicolas@nicolargo.com>
+#
+# This script is distributed
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This script is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.";
+#
+# Syntax: throughput.py [-H <host>] [-p <port>] [-n <runs>] [-j <concurrent runs>]
+#                       [-i <python>] [-e <entry>] [-s <stat,stat...>] [-o <plugin options>]
+#                       [--hosts <n,n...>] [--api <xmlrpc|rest>] [--sim <simulator options>]
+#   Without -H, a local simulator (glancessim.py) is started with --sim options
+#   (default port 61299, 61288 for the REST API)
+#   hosts: number of hosts checked by one run (-H 127.0.0.1,127.0.0.2...),
+#          the simulator answers on all the loopback addresses
+#   checks/s: checked hosts per second, p50/p99: run latency (ms),
+#   rss: peak resident memory of the runs (KB), errors: UNKNOWN checks, or
+#   the hosts of the killed or crashed (Python traceback on stderr) runs
+#   (several hosts: the return codes of the passive results written on stdout)
+#
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+# Stats and their plugin options (instances of the simulator)
+stats = (('system', ['-s', 'system']),
+         ('cpu', ['-s', 'cpu']),
+         ('load', ['-s', 'load']),
+         ('mem', ['-s', 'mem']),
+         ('net', ['-s', 'net', '-e', 'eth0']),
+         ('net:*', ['-s', 'net', '-e', '*']),
+         ('diskio', ['-s', 'diskio', '-e', 'sda']),
+         ('fs', ['-s', 'fs', '-e', '/']),
+         ('fs:*', ['-s', 'fs', '-e', '*']),
+         ('topproc', ['-s', 'topproc']),
+         ('all', ['-s', 'all']))
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loopback(i):
+    """
+    i-th loopback address: 127.0.0.1, 127.0.0.2...
+    """
+    i += 1
+    return "127.%d.%d.%d" % ((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+
+def percentile(values, p):
+    """
+    p-th percentile of the sorted values (nearest rank)
+    """
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def spawn(command, env, output, errors):
+    """
+    Start command, its stdout and stderr are written in the output and errors files
+    """
+    pid = os.fork()
+    if pid == 0:
+        os.dup2(os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 1)
+        os.dup2(os.open(errors, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 2)
+        try:
+            os.execve(command[0], command, env)
+        finally:
+            os._exit(127)
+    return pid
+
+
+def failedhosts(output, hosts):
+    """
+    Number of UNKNOWN (or missing) hosts in the passive results of a run
+    [time] PROCESS_SERVICE_CHECK_RESULT;<host>;<service>;<return code>;<output>
+    """
+    checked = 0
+    failed = 0
+    for line in output.splitlines():
+        fields = line.split(";", 4)
+        if (len(fields) == 5) and fields[0].endswith("PROCESS_SERVICE_CHECK_RESULT"):
+            checked += 1
+            if not fields[3].isdigit() or (int(fields[3]) > 2):
+                failed += 1
+    return failed + max(0, hosts - checked)
+
+
+def runs(command, env, number, concurrency, logdir, hosts = 1):
+    """
+    Run command number times, concurrency at a time, checking hosts hosts
+    The stdout and stderr of the runs are kept in logdir until they end
+    Return the (total wall time, sorted latencies, peak RSS in KB, errors)
+    """
+    running = {}
+    latencies = []
+    rss = 0
+    errors = 0
+    start = time.time()
+    started = 0
+    while (started < number) or running:
+        while (started < number) and (len(running) < concurrency):
+            stdout = os.path.join(logdir, "stdout.%d" % started)
+            stderr = os.path.join(logdir, "stderr.%d" % started)
+            running[spawn(command, env, stdout, stderr)] = (time.time(), stdout, stderr)
+            started += 1
+        pid, status, rusage = os.wait4(-1, 0)
+        begin, stdout, stderr = running.pop(pid)
+        latencies.append(time.time() - begin)
+        rss = max(rss, rusage.ru_maxrss)
+        with open(stdout) as f:
+            output = f.read()
+        # An uncaught exception exits with 1 (WARNING for Nagios)
+        with open(stderr) as f:
+            crashed = "Traceback" in f.read()
+        os.unlink(stdout)
+        os.unlink(stderr)
+        if crashed or not os.WIFEXITED(status):
+            errors += hosts
+        elif (hosts > 1):
+            # Passive results: the run exits with 0, one return code per host
+            errors += failedhosts(output, hosts)
+        elif (os.WEXITSTATUS(status) > 2):
+            errors += 1
+    latencies.sort()
+    return (time.time() - start, latencies, rss, errors)
+
+
+def main():
+    host = None
+    port = None
+    number = 50
+    concurrency = 1
+    python = sys.executable
+    entry = "checkglances.py"
+    selected = None
+    options = []
+    hostcounts = [1]
+    api = 'xmlrpc'
+    simoptions = []
+    opts, args = getopt.getopt(sys.argv[1:], "H:p:n:j:i:e:s:o:", ["hosts=", "api=", "sim="])
+    for opt, arg in opts:
+        if opt == "-H":
+            host = arg
+        elif opt == "-p":
+            port = arg
+        elif opt == "-n":
+            number = int(arg)
+        elif opt == "-j":
+            concurrency = int(arg)
+        elif opt == "-i":
+            python = arg
+        elif opt == "-e":
+            entry = arg
+        elif opt == "-s":
+            selected = arg.split(",")
+        elif opt == "-o":
+            options = arg.split()
+        elif opt == "--hosts":
+            hostcounts = [int(n) for n in arg.split(",")]
+        elif opt == "--api":
+            api = arg
+        elif opt == "--sim":
+            simoptions = arg.split()
+    if port is None:
+        # Not the Glances ports for the simulator (a Glances server may run here)
+        if host is None:
+            port = "61288" if (api == 'rest') else "61299"
+        else:
+            port = "61208" if (api == 'rest') else "61209"
+    if (api != 'xmlrpc'):
+        options = ["--api", api] + options
+
+    simulator = None
+    if host is None:
+        # The simulator answers on all the loopback addresses (several hosts)
+        simulator = subprocess.Popen([python, os.path.join(root, "bench", "glancessim.py"),
+                                      "-B", "0.0.0.0" if max(hostcounts) > 1 else "127.0.0.1",
+                                      "-p", port, "--api", api] + simoptions)
+        time.sleep(1)
+    cachedir = tempfile.mkdtemp(prefix = "checkglances-bench-")
+    env = dict(os.environ)
+    env["TMPDIR"] = cachedir
+    print("%s %s -p %s %s, %d runs, %d at a time" % (python, entry, port, " ".join(options),
+                                                     number, concurrency))
+    print("%-10s %6s %10s %10s %10s %10s %6s" % ("stat", "hosts", "checks/s", "p50 ms",
+                                                 "p99 ms", "rss KB", "errors"))
+    try:
+        for name, statoptions in stats:
+            if selected and (name not in selected):
+                continue
+            for hostcount in hostcounts:
+                if host is not None:
+                    hosts = ",".join([host] * hostcount)
+                else:
+                    hosts = ",".join([loopback(i) for i in range(hostcount)])
+                command = ([python, os.path.join(root, entry), "-H", hosts, "-p", port]
+                           + statoptions + options)
+                wall, latencies, rss, errors = runs(command, env, number, concurrency, cachedir,
+                                                    hostcount)
+                print("%-10s %6d %10.1f %10.1f %10.1f %10d %6d" % (
+                    name, hostcount, number * hostcount / wall, percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000, rss, errors))
+    finally:
+        shutil.rmtree(cachedir, ignore_errors = True)
+        if simulator is not None:
+            simulator.terminate()
+            simulator.wait()
+
+
+if __name__ == "__main__":
+    main()
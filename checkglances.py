@@ -27,13 +27,41 @@ __licence__ = "LGPL"
 # Import libs
 #############
 
+# Only the modules needed by a check are imported here: the plugin is
+# started for every check, the other modules are imported when used
+import os
 import sys
 import time
 import getopt
+import re
+import httplib
+import socket
 import xmlrpclib
 import json
-import gettext
-gettext.install(__appname__)
+
+# Clock of the phase timers (no monotonic clock in the Python 2 time module)
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def translation(domain = __appname__):
+    """
+    Return _(): gettext only if a translation of the plugin is installed
+    Bound in this module, the _() of the importing program is kept
+    """
+    localedir = os.path.join(sys.prefix, 'share', 'locale')
+    for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+        if os.environ.get(envar):
+            for language in os.environ[envar].split(":"):
+                # fr_FR.UTF-8@euro => fr_FR, then fr
+                language = language.split(".")[0].split("@")[0]
+                for lang in (language, language.split("_")[0]):
+                    if os.path.exists(os.path.join(localedir, lang, 'LC_MESSAGES', domain + '.mo')):
+                        import gettext
+                        return gettext.translation(domain).gettext
+            break
+    return lambda message: message
+
+_ = translation()
 
 # Classes
 #########
@@ -95,13 +123,543 @@ class nagiospluginskeleton(object):
         sys.exit(self.return_codes[code])
 
 
+class glancesconnection(httplib.HTTPConnection):
+    """
+    HTTP connection with distinct connect and read timeouts
+    owner: object whose connecttime is increased by the time spent in connect()
+    and whose deadline (monotonic() time or None) bounds the timeouts
+    """
+
+    def __init__(self, host, connecttimeout = None, readtimeout = None, owner = None):
+        httplib.HTTPConnection.__init__(self, host, timeout = connecttimeout)
+        self.connecttimeout = connecttimeout
+        self.readtimeout = readtimeout
+        self.owner = owner
+
+
+    def putrequest(self, *args, **kwargs):
+        # Every request of a kept connection gets the time left
+        if self.sock is not None:
+            self.sock.settimeout(self.budget(self.readtimeout))
+        httplib.HTTPConnection.putrequest(self, *args, **kwargs)
+
+
+    def budget(self, timeout):
+        """
+        Return timeout bounded by the time left before the owner deadline
+        Raise socket.timeout if the deadline is exceeded
+        """
+        deadline = getattr(self.owner, 'deadline', None)
+        if deadline is None:
+            return timeout
+        left = deadline - monotonic()
+        if (left <= 0):
+            raise socket.timeout("deadline exceeded")
+        return left if (timeout is None) else min(timeout, left)
+
+
+    def connect(self):
+        self.timeout = self.budget(self.connecttimeout)
+        start = monotonic()
+        try:
+            httplib.HTTPConnection.connect(self)
+        finally:
+            if self.owner is not None:
+                self.owner.connecttime += monotonic() - start
+        self.sock.settimeout(self.budget(self.readtimeout))
+        # Small requests: do not wait for the ACK of the previous segment
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = budgetsocket(self.sock, self)
+
+
+class budgetsocket(object):
+    """
+    Socket of a glancesconnection: every recv() gets the time left before
+    the deadline, a response trickled byte by byte does not outlast it
+    """
+
+    def __init__(self, sock, connection):
+        self.sock = sock
+        # Inner socket, read like socket.makefile() does: a response is
+        # still read after the connection is closed (Connection: close)
+        self.inner = sock._sock
+        self.connection = connection
+
+
+    def recv(self, *args):
+        self.inner.settimeout(self.connection.budget(self.connection.readtimeout))
+        return self.inner.recv(*args)
+
+
+    def makefile(self, mode = 'r', bufsize = -1):
+        # Read through recv()
+        return socket._fileobject(self, mode, bufsize)
+
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class glancestransport(xmlrpclib.Transport):
+    """
+    XML-RPC transport keeping its HTTP/1.1 connection to the Glances server
+    between the calls (retried once if the server closed it)
+    gzip: ask for gzip encoded responses (large getFs, getProcessList...)
+    """
+
+    def __init__(self, connecttimeout = None, readtimeout = None, gzip = True):
+        xmlrpclib.Transport.__init__(self)
+        self.connecttimeout = connecttimeout
+        self.readtimeout = readtimeout
+        self.accept_gzip_encoding = gzip
+        # Time spent in opening the connections (seconds)
+        self.connecttime = 0.0
+        # End of the check (see glancesconnection.budget())
+        self.deadline = None
+
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        self._connection = host, glancesconnection(chost, self.connecttimeout, self.readtimeout,
+                                                   self)
+        return self._connection[1]
+
+
+class glancesrest(object):
+    """
+    Glances REST API client (glances -w) used like the XML-RPC proxy:
+    gs.getCpu() returns the JSON of GET /api/<version>/cpu
+    Unknown methods or plugins raise xmlrpclib.Fault
+    """
+
+    # Glances plugin behind each XML-RPC method
+    methodsplugins = {'getAll': 'all',
+                      'getAllPlugins': 'pluginslist',
+                      'getSystem': 'system',
+                      'getUptime': 'uptime',
+                      'getCpu': 'cpu',
+                      'getPerCpu': 'percpu',
+                      'getCore': 'core',
+                      'getLoad': 'load',
+                      'getMem': 'mem',
+                      'getMemSwap': 'memswap',
+                      'getProcessCount': 'processcount',
+                      'getNetwork': 'network',
+                      'getDiskIO': 'diskio',
+                      'getFs': 'fs',
+                      'getProcessList': 'processlist',
+                      'getDocker': 'docker'}
+
+    # Large responses, streamed (see stream())
+    streamedmethods = ('getProcessList',)
+
+    def __init__(self, host, port, password = '', version = 3,
+                 connecttimeout = None, readtimeout = None, gzip = True):
+        self.host = "%s:%d" % (host, int(port))
+        self.password = password
+        self.version = version
+        self.connecttimeout = connecttimeout
+        self.readtimeout = readtimeout
+        self.gzip = gzip
+        self.connection = None
+        # Time spent in opening the connections (seconds)
+        self.connecttime = 0.0
+        # End of the check (see glancesconnection.budget())
+        self.deadline = None
+        # gs.system.listMethods() and gs.system.multicall() (not available)
+        self.system = self
+
+
+    def __getattr__(self, method):
+        if method not in self.methodsplugins:
+            raise AttributeError(method)
+        if method in self.streamedmethods:
+            return lambda: self.stream(self.methodsplugins[method])
+        return lambda: self.request(self.methodsplugins[method])
+
+
+    def listMethods(self):
+        return sorted(self.methodsplugins)
+
+
+    def multicall(self, calls):
+        raise xmlrpclib.Fault(404, "system.multicall is not available with the REST API")
+
+
+    def send(self, path):
+        """
+        GET /api/<version>/<path> on the kept HTTP/1.1 connection
+        Return the response, its body is not read
+        """
+        headers = {}
+        if self.gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        if (self.password != ''):
+            import base64
+            headers['Authorization'] = 'Basic ' + base64.b64encode('glances:%s' % self.password)
+        url = '/api/%d/%s' % (self.version, path)
+        # Retry once if the kept connection has been closed by the server
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = glancesconnection(self.host, self.connecttimeout,
+                                                    self.readtimeout, self)
+            try:
+                self.connection.request('GET', url, headers = headers)
+                response = self.connection.getresponse()
+                break
+            except (socket.error, httplib.HTTPException):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        if (response.status != 200):
+            response.read()
+            if (response.status == 404):
+                raise xmlrpclib.Fault(404, "%s not found" % url)
+            raise xmlrpclib.ProtocolError(self.host + url, response.status, response.reason,
+                                          response.msg)
+        return response
+
+
+    def request(self, path):
+        """
+        Return the JSON response of GET /api/<version>/<path>
+        """
+        response = self.send(path)
+        data = response.read()
+        if (response.getheader('content-encoding') == 'gzip'):
+            import zlib
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        return data
+
+
+    def stream(self, path):
+        """
+        Return an iterator on the chunks of the JSON response of
+        GET /api/<version>/<path>, read from the connection when used
+        The request is sent at once: HTTP errors are raised here
+        """
+        return self.chunks(self.send(path))
+
+
+    def chunks(self, response):
+        """
+        Iterate on the (decompressed) chunks of the response body
+        """
+        decompress = None
+        if (response.getheader('content-encoding') == 'gzip'):
+            import zlib
+            decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            if self.connection is not None:
+                self.connection.budget(None)
+            data = response.read(65536)
+            if not data:
+                break
+            yield decompress.decompress(data) if decompress else data
+        if decompress:
+            yield decompress.flush()
+
+
+    def select(self, method, key, value):
+        """
+        Server side selection of the list items whose key is value
+        (GET /api/<version>/network/interface_name/eth0 for example)
+        Return the JSON list of the selected items, None if not possible
+        """
+        if (method not in self.methodsplugins) or ("/" in value) or ("\\" in value):
+            # The REST routes do not match an escaped slash
+            return None
+        import urllib
+        try:
+            items = json.loads(self.request('%s/%s/%s' % (self.methodsplugins[method], key,
+                                                           urllib.quote(value, ''))))
+        except (xmlrpclib.Error, ValueError):
+            return None
+        return json.dumps(items.get(value, []))
+
+
+class checkresult(object):
+    """
+    Result of a check (see nagiosplugin.run())
+    status: 'OK', 'WARNING', 'CRITICAL' or 'UNKNOWN'
+    message: one line text message
+    perfdata: list of (label, value) tuples
+    details: one checkresult per stat when several stats are checked
+    name: stat (and param) of a detail
+    """
+
+    def __init__(self, status, message, perfdata = None, details = None, name = None):
+        self.status = status
+        self.message = message
+        self.perfdata = perfdata or []
+        self.details = details or []
+        self.name = name
+
+
+    def __repr__(self):
+        return "<checkresult %s: %s>" % (self.status, self.message)
+
+
+    def code(self):
+        """
+        Return the Nagios return code of the status
+        """
+        return nagiospluginskeleton.return_codes[self.status]
+
+
+    def output(self):
+        """
+        Return the Nagios plugin output: the message and the perfdata,
+        then one line per detail
+        """
+        output = [self.message]
+        if self.perfdata:
+            # Quotes of the labels are doubled
+            output.append(" |")
+            output += [" '%s'=%s" % (label.replace("'", "''"), value) for label, value in self.perfdata]
+        output += ["\n%s %s: %s" % (detail.name, detail.status, detail.message)
+                   for detail in self.details]
+        return "".join(output)
+
+
+class phasetimer(object):
+    """
+    Wall time of the phases of a check: connect, cache, probe, rpc,
+    decode, check and output (see nagiosplugin.check())
+    info: what is timed (host, stat...), for the timing log
+    """
+
+    def __init__(self, **info):
+        self.info = info
+        # [name, seconds] in the order the phases started
+        self.phases = []
+        self.current = None
+        self.start = self.since = monotonic()
+        self.connecttime = None
+        self.opened = 0.0
+
+
+    def phase(self, name = None):
+        """
+        End the current phase and start the given one (None: stop the timer)
+        Return the name of the ended phase
+        """
+        now = monotonic()
+        previous = self.current
+        if previous is not None:
+            elapsed = now - self.since
+            if self.connecttime is not None:
+                # The connections are opened by the first call of a phase
+                opened = self.connecttime()
+                self.add('connect', opened - self.opened)
+                elapsed -= opened - self.opened
+                self.opened = opened
+            self.add(previous, elapsed)
+        self.current = name
+        self.since = now
+        return previous
+
+
+    def watch(self, connecttime):
+        """
+        connecttime(): seconds spent in opening connections so far,
+        moved from the current phase to the connect phase
+        """
+        self.connecttime = connecttime
+        self.opened = connecttime()
+
+
+    def add(self, name, seconds):
+        for phase in self.phases:
+            if (phase[0] == name):
+                phase[1] += max(0, seconds)
+                return
+        self.phases.append([name, max(0, seconds)])
+
+
+    def milliseconds(self):
+        """
+        Return the [(phase, ms)] list, ended by the total
+        """
+        end = monotonic() if (self.current is not None) else self.since
+        return [(name, seconds * 1000) for name, seconds in self.phases] + \
+               [('total', (end - self.start) * 1000)]
+
+
 class nagiosplugin(nagiospluginskeleton):
     """
     These class defines your Nagios Plugin
     """
 
-    statslist = ('system', 'uptime', 'cpu', 'load', 'mem', 'swap', 'process', 'net', 'diskio', 'fs')
-    statsparamslist = ( 'net' , 'diskio' , 'fs')
+    statslist = ('system', 'uptime', 'cpu', 'percpu', 'load', 'mem', 'swap', 'process', 'net', 'diskio', 'fs', 'fsforecast', 'topproc', 'docker')
+    statsparamslist = ( 'net' , 'diskio' , 'fs', 'fsforecast', 'topproc', 'docker', 'percpu')
+
+    # Parameter of the stats without -e
+    statsdefaultparams = {'docker': '*'}
+
+    # Unit, min and max of the perfdata of each stat (see perfdata())
+    # max: a number or the key of the total in the same entry
+    perfdataunits = {'cpu': ((('percent', 'total', 'user', 'system', 'kernel', 'idle', 'nice',
+                               'iowait', 'irq', 'softirq', 'steal', 'guest', 'guest_nice'), '%', 0, 100),
+                             (('time_since_update',), 's', 0, None)),
+                     'percpu': ((('max', 'mean', 'p50', 'p95', 'imbalance'), '%', 0, 100),
+                                (('above',), '', 0, 'cores'),
+                                (('cores',), '', 0, None)),
+                     'load': ((('min1', 'min5', 'min15'), '', 0, None),),
+                     'mem': ((('percent',), '%', 0, 100),
+                             (('total',), 'B', 0, None),
+                             (('available', 'used', 'free', 'active', 'inactive', 'buffers',
+                               'cached', 'shared', 'wired'), 'B', 0, 'total')),
+                     'swap': ((('percent',), '%', 0, 100),
+                              (('total', 'sin', 'sout'), 'B', 0, None),
+                              (('used', 'free'), 'B', 0, 'total'),
+                              (('time_since_update',), 's', 0, None)),
+                     'process': ((('total', 'running', 'sleeping', 'thread'), '', 0, None),),
+                     'net': ((('rx', 'tx', 'cx', 'rx_rate', 'tx_rate'), 'B', 0, None),
+                             (('cumulative_rx', 'cumulative_tx', 'cumulative_cx'), 'c', 0, None),
+                             (('time_since_update',), 's', 0, None)),
+                     'diskio': ((('read_bytes', 'write_bytes', 'read_rate', 'write_rate'), 'B', 0, None),
+                                (('read_count', 'write_count'), '', 0, None),
+                                (('time_since_update',), 's', 0, None)),
+                     'fs': ((('percent', 'pctfree'), '%', 0, 100),
+                            (('size',), 'B', 0, None),
+                            (('used', 'free'), 'B', 0, 'size')),
+                     'docker': ((('cpu',), '%', 0, None),
+                                (('mem',), '%', 0, 100),
+                                (('mem_limit',), 'B', 0, None),
+                                (('mem_usage',), 'B', 0, 'mem_limit'))}
+
+    # Glances methods needed to check each stat
+    statsmethods = {'system': ('getSystem',),
+                    'uptime': ('getUptime',),
+                    'cpu': ('getCpu',),
+                    'percpu': ('getPerCpu',),
+                    'load': ('getCore', 'getLoad'),
+                    'mem': ('getMem',),
+                    'swap': ('getMemSwap',),
+                    'process': ('getProcessCount',),
+                    'net': ('getNetwork',),
+                    'diskio': ('getDiskIO',),
+                    'fs': ('getFs',),
+                    'fsforecast': ('getFs',),
+                    'topproc': ('getProcessList',),
+                    'docker': ('getDocker',)}
+
+    # Glances plugin name behind each method (keys of the getAll() response)
+    methodsplugins = {'getSystem': 'system',
+                      'getUptime': 'uptime',
+                      'getCpu': 'cpu',
+                      'getPerCpu': 'percpu',
+                      'getCore': 'core',
+                      'getLoad': 'load',
+                      'getMem': 'mem',
+                      'getMemSwap': 'memswap',
+                      'getProcessCount': 'processcount',
+                      'getNetwork': 'network',
+                      'getDiskIO': 'diskio',
+                      'getFs': 'fs',
+                      'getProcessList': 'processlist',
+                      'getDocker': 'docker'}
+
+    # Large responses: not grabbed by getAll() or system.multicall
+    streamedmethods = ('getProcessList',)
+
+    # Process sort keys of the topproc stat
+    topprockeys = ('cpu', 'mem', 'io')
+
+    # Rates of the net and diskio stats (--rates): (rate, cumulative counter,
+    # delta over the server refresh period) of the in and out directions
+    # Glances gives no cumulative disk counters: the deltas per second
+    ratescounters = {'net': (('rx_rate', 'cumulative_rx', 'rx'), ('tx_rate', 'cumulative_tx', 'tx')),
+                     'diskio': (('read_rate', None, 'read_bytes'), ('write_rate', None, 'write_bytes'))}
+
+    # Statistics of the readings (--samples, see aggregate())
+    statistics = ('mean', 'max', 'p95')
+    # Keys whose low values are the bad ones: max is their minimum, p95 their 5th percentile
+    samplesreversed = ('idle', 'available', 'free')
+
+    # Cores from which NumPy (if installed) computes the percpu summary:
+    # below, its import costs more than the loops (see corestats())
+    vectorizecores = 128
+
+    # List methods and the key of their items (see index())
+    statsinstances = {'net': ('getNetwork', 'interface_name'),
+                      'diskio': ('getDiskIO', 'disk_name'),
+                      'fs': ('getFs', 'mnt_point'),
+                      'fsforecast': ('getFs', 'mnt_point'),
+                      'docker': ('getDocker', 'name')}
+
+    # Responses kept in the server metadata (see discover())
+    metadatamethods = ('getSystem', 'getCore')
+
+    def __init__(self, pool = None):
+        """
+        Init the class
+        pool: shared connectionpool (daemon mode) or None
+        """
+        super(nagiosplugin, self).__init__()
+        self.pool = pool
+        self.connections = []
+        # Shared responsecache (--cache-ttl) or None
+        self.cache = None
+        # Glances servers metadatacache (--metadata-ttl) or None
+        self.metadata = None
+        # Decoded list responses (see index())
+        self.indexes = {}
+        # Glances server connections (see glancestransport)
+        self.connecttimeout = 5
+        self.readtimeout = 30
+        self.gzip = True
+        # Glances server API: 'xmlrpc' or 'rest' (see glancesrest)
+        self.api = 'xmlrpc'
+        self.apiversion = 3
+        # Phases time of the current check (see check())
+        self.timer = phasetimer()
+        # Phases time in the perfdata (--timings), JSON lines log (--timing-log)
+        self.timings = False
+        self.timinglog = None
+        # Time of all the calls of a check in seconds (--deadline) or None
+        self.deadline = None
+        # Failing Glances servers circuitbreaker (--breaker-failures) or None
+        self.breaker = None
+        # Metrics history (--history) or None
+        self.history = None
+        # Net and diskio checked on their rates (--rates)
+        self.userates = False
+        # Counters of the net rates (--rates), counterstate or None
+        self.rates = None
+        # Why the cache directory can not be used (not private), or None
+        self.cacheerror = None
+        # (host, port) of the current check
+        self.server = None
+        # Readings of the stats every interval seconds (--samples, --interval)
+        # evaluated on their statistic (--statistic)
+        self.samples = 1
+        self.interval = 1
+        self.statistic = 'mean'
+        # Perfdata keys kept (--perfdata-keys globs) or None for all
+        self.perfdatakeys = None
+        # Time series database metricspusher (--push) or None
+        self.push = None
+        # Responses written (--record) or read instead of the Glances server (--replay),
+        # responserecorder or None
+        self.record = None
+        self.replay = None
+
+
+    def worker(self):
+        """
+        Return a new plugin with the same settings (one per thread)
+        """
+        import copy
+        plugin = copy.copy(self)
+        plugin.connections = []
+        plugin.indexes = {}
+        return plugin
+
 
     def syntax(self):
         # Display the standard syntax
@@ -111,8 +669,183 @@ class nagiosplugin(nagiospluginskeleton):
         print("        "+_("-P <password>  Glances server password (optional)"))
         print("        "+_("-s <stat>      Select stat to grab: %s")
                                             % ", ".join(self.statslist))
+        print("        "+_("               Several stats: -s cpu,mem,fs:/ (or -s all)"))
         print("        "+_("-e <param>     Extended parameter for stat: %s")
                                             % ", ".join(self.statsparamslist))
+        print("        "+_("               Several instances: glob (-e 'eth*', -e '*') or regex (-e 're:^sd[a-z]$')"))
+        print("        "+_("-H <h1,h2,...> Check several hosts (or -H @<file>, one host per line)"))
+        print("        "+_("               and write the results as passive checks (default on stdout):"))
+        print("        "+_("--command-file <f>      Nagios external command file"))
+        print("        "+_("--checkresults-dir <d>  Nagios check results spool directory"))
+        print("        "+_("--service <name>        Service description (default: stat and param)"))
+        print("        "+_("--workers <n>           Hosts checked in parallel (default 16)"))
+        print("        "+_("--cache-ttl <s>         Share the Glances responses between checks for s seconds"))
+        print("        "+_("--cache-dir <d>         Cache directory (default %s)") % responsecache.default_dir)
+        print("        "+_("--cache-size <n>        Maximum number of cached responses (default 1000)"))
+        print("        "+_("--history <n>           Samples kept per metric in the cache directory"))
+        print("        "+_("                        (default 1024, 0 to disable), see fsforecast"))
+        print("        "+_("--metadata-ttl <s>      Keep the server metadata (version, system, cores)"))
+        print("        "+_("                        in the cache directory for s seconds (default 3600, 0 to disable)"))
+        print("        "+_("--api <api>             Glances server API: xmlrpc (default) or rest"))
+        print("        "+_("                        (glances -w, default port 61208)"))
+        print("        "+_("--api-version <n>       Glances REST API version (default 3)"))
+        print("        "+_("--connect-timeout <s>   Glances server connection timeout (default 5)"))
+        print("        "+_("--timeout <s>           Glances server response timeout (default 30)"))
+        print("        "+_("--no-gzip               Do not ask for gzip encoded responses"))
+        print("        "+_("--deadline <s>          Time of all the Glances server calls of a check"))
+        print("        "+_("--breaker-failures <n>  Failures in a row before a Glances server is not asked"))
+        print("        "+_("                        for a cool-down period (default 3, 0 to disable)"))
+        print("        "+_("--breaker-cooldown <s>  Cool-down period (default 60 seconds)"))
+        print("        "+_("--rates                 net and diskio: check the bytes per second since the previous"))
+        print("        "+_("                        check (counters kept in the cache directory), rx/tx_rate..."))
+        print("        "+_("--perfdata-keys <k,k>   Only these perfdata keys (globs: -s net -e '*' --perfdata-keys rx,tx)"))
+        print("        "+_("--timings               Add the time of the check phases to the perfdata"))
+        print("        "+_("                        (connect_ms, cache_ms, probe_ms, rpc_ms, decode_ms...)"))
+        print("        "+_("--timing-log <f>        Append the time of the check phases to f (JSON lines)"))
+        print("        "+_("--profile               Print the profile of the run on stderr"))
+        print("        "+_("--exporter              Poll the hosts in the background and serve their stats"))
+        print("        "+_("                        as Prometheus metrics on http://<listen>/metrics"))
+        print("        "+_("                        (default -s %s, all the instances)") % metricsexporter.default_stats)
+        print("        "+_("--listen <[addr:]port>  Exporter address (default %s)") % metricsexporter.default_listen)
+        print("        "+_("--interval <s>          Exporter polling interval (default 15),"))
+        print("        "+_("                        time between the --samples (default 1)"))
+        print("        "+_("--samples <n>           Read the stats n times, every --interval seconds (default 1)"))
+        print("        "+_("                        on the same connection, and check their --statistic"))
+        print("        "+_("--statistic <s>         Statistic of the samples: mean (default), max or p95"))
+        print("        "+_("--push <target>         Also push the perfdata to a time series database:"))
+        print("        "+_("                        tcp://<host>:<port>, udp://<host>:<port> or a spool file"))
+        print("        "+_("--push-format <f>       influx (line protocol, default) or graphite (plaintext)"))
+        print("        "+_("--push-batch <bytes>    Size of the pushed batches (default 65536)"))
+        print("        "+_("--record <d>            Write the raw Glances responses of the checks in d"))
+        print("        "+_("--record-level <n>      gzip level of the recorded responses (default 6, 0: none)"))
+        print("        "+_("--replay <d>            Check the responses recorded in d, without Glances server"))
+        print("        "+_("--daemon       Answer the checks of checkglances_client.py (see --socket)"))
+        print("        "+_("--socket <f>   Daemon Unix socket (default %s)") % checkdaemon.default_socket)
+
+
+    def connect(self, host, port, password):
+        """
+        Return a XML-RPC proxy (or a glancesrest) to the Glances server
+        Taken from the connection pool if any (see release())
+        """
+        key = (host, int(port), password, self.api, self.apiversion,
+               self.connecttimeout, self.readtimeout, self.gzip)
+        gs = None
+        if self.pool is not None:
+            gs = self.pool.get(key)
+        if (gs is None) and (self.api == 'rest'):
+            gs = glancesrest(host, port, password, self.apiversion,
+                             self.connecttimeout, self.readtimeout, self.gzip)
+        elif gs is None:
+            transport = glancestransport(self.connecttimeout, self.readtimeout, self.gzip)
+            if (password != ''):
+                gs = xmlrpclib.ServerProxy('http://%s:%s@%s:%d' % \
+                    ('glances', password, host, int(port)), transport = transport)
+            else:
+                gs = xmlrpclib.ServerProxy('http://%s:%d' % (host, int(port)),
+                                           transport = transport)
+        self.connections.append((key, gs))
+        return gs
+
+
+    def release(self):
+        """
+        Give back the connections to the pool
+        """
+        if self.pool is not None:
+            for key, gs in self.connections:
+                self.pool.put(key, gs)
+        self.connections = []
+
+
+    def transport(self, gs):
+        """
+        Return the object owning the connections of gs
+        (glancestransport of a XML-RPC proxy, or the glancesrest)
+        """
+        if isinstance(gs, glancesrest):
+            return gs
+        return gs("transport")
+
+
+    def connecttime(self, gs):
+        """
+        Return the seconds spent by gs in opening its connections
+        """
+        return self.transport(gs).connecttime
+
+
+    def connectionfailed(self, gs, host, port, breaker = None):
+        """
+        The Glances server did not answer: count the failure
+        Return the UNKNOWN checkresult
+        """
+        if self.breaker is not None:
+            self.breaker.failure(host, port, breaker)
+        deadline = self.transport(gs).deadline
+        if (deadline is not None) and (monotonic() >= deadline):
+            return checkresult('UNKNOWN', _("Connection to Glances server failed: deadline of %s seconds exceeded")
+                               % self.deadline)
+        return checkresult('UNKNOWN', _("Connection to Glances server failed"))
+
+
+    def decode(self, response, parse = json.loads):
+        """
+        Return the decoded Glances response, timed in the decode phase
+        """
+        previous = self.timer.phase('decode')
+        try:
+            return parse(response)
+        finally:
+            self.timer.phase(previous)
+
+
+    def timingsperfdata(self):
+        """
+        Return the phases time perfdata (--timings), [] if not asked
+        """
+        if not self.timings:
+            return []
+        return [("%s_ms" % name, "%.3fms" % ms) for name, ms in self.timer.milliseconds()]
+
+
+    def logtimings(self, status):
+        """
+        Log the phases time of the check (-v, --timing-log)
+        """
+        milliseconds = self.timer.milliseconds()
+        self.log(_("Timings: %s") % ", ".join(["%s %.3f ms" % t for t in milliseconds]))
+        if self.timinglog is None:
+            return
+        entry = dict(self.timer.info)
+        entry.update([("%s_ms" % name, round(ms, 3)) for name, ms in milliseconds])
+        entry['time'] = time.time()
+        entry['status'] = status
+        # One write() in append mode: the lines of concurrent checks are not mixed
+        try:
+            fd = os.open(self.timinglog, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, json.dumps(entry, sort_keys = True) + "\n")
+            finally:
+                os.close(fd)
+        except OSError as err:
+            self.log(_("Can not write the timing log: %s") % err)
+
+
+    def pushmetrics(self, host, results, responses):
+        """
+        Give the numeric perfdata of the (stat, param, perfdata) results
+        of host to the metricspusher (--push)
+        """
+        if self.push is None:
+            return
+        previous = self.timer.phase('push')
+        try:
+            self.push.add(host, [(stat, instance, values)
+                                 for stat, param, perfdata in results
+                                 for instance, values in self.series(stat, param, perfdata, responses)])
+        finally:
+            self.timer.phase(previous)
 
 
     # def methodexist(self, server, method):
@@ -121,6 +854,117 @@ class nagiosplugin(nagiospluginskeleton):
     #     return True
 
 
+    def parsestats(self, stat, statparam = ""):
+        """
+        Split a -s value into a list of (stat, param) tuples
+        'cpu,net:eth0,fs:C:' => [('cpu', ''), ('net', 'eth0'), ('fs', 'C:')]
+        'all' => every stat without extended parameter
+        The -e value is used when a stat taking a parameter (statsparamslist)
+        does not define its own, then the default parameter of the stat
+        (docker: all the containers)
+        """
+        stats = []
+        for item in stat.split(","):
+            name, sep, param = item.strip().partition(":")
+            if (name == "all"):
+                stats += [(s, "") for s in self.statslist
+                          if s not in self.statsparamslist]
+            elif (name != ""):
+                if not sep:
+                    param = statparam if (name in self.statsparamslist) else ""
+                stats.append((name, param or self.statsdefaultparams.get(name, "")))
+        return stats
+
+
+    def threshold(self, value, warning, critical, reverse = False):
+        """
+        Return the status of value regarding the warning and critical thresholds
+        reverse: the lower the value, the worse (uptime, time left...)
+        """
+        if reverse:
+            if (value > float(warning)):
+                return 'OK'
+            elif (value > float(critical)):
+                return 'WARNING'
+            else:
+                return 'CRITICAL'
+        if (value < float(warning)):
+            return 'OK'
+        elif (value < float(critical)):
+            return 'WARNING'
+        else:
+            return 'CRITICAL'
+
+
+    def discover(self, gs, responses):
+        """
+        Return the static metadata of a Glances server: version,
+        methods (system.listMethods) and the metadatamethods responses
+        """
+        metadata = dict([(m, responses.get(m)) for m in self.metadatamethods])
+        metadata['methods'] = None
+        metadata['version'] = None
+        try:
+            metadata['methods'] = gs.system.listMethods()
+            # init() returns the Glances version
+            if 'init' in metadata['methods']:
+                metadata['version'] = gs.init()
+        except Exception as err:
+            self.log(_("Can not get the server metadata: %s") % err)
+        return metadata
+
+
+    def fetch(self, gs, methods, capabilities = None):
+        """
+        Grab the given Glances methods in as few round trips as possible
+        capabilities: the system.listMethods() list if known
+        Return a dict {method: JSON response}, failed methods are missing
+        """
+        responses = {}
+        batch = [m for m in methods if m not in self.streamedmethods]
+        # REST API: one GET per plugin on the kept connection, smaller
+        # than /all (the process list included)
+        batching = not isinstance(gs, glancesrest)
+
+        if batching and (len(batch) > 1) and \
+           ((capabilities is None) or ('system.multicall' in capabilities)):
+            # One round trip: system.multicall
+            multicall = xmlrpclib.MultiCall(gs)
+            for method in batch:
+                getattr(multicall, method)()
+            try:
+                for method, response in zip(batch, multicall()):
+                    responses[method] = response
+            except xmlrpclib.Fault:
+                # No multicall on the server or one of the method is unknown
+                pass
+        missing = [m for m in batch if m not in responses]
+        if batching and (len(missing) > 1) and ((capabilities is None) or
+                                   ('system.multicall' not in capabilities and 'getAll' in capabilities)):
+            # One round trip: getAll() (all the plugins, the process list
+            # included), only without system.multicall
+            try:
+                allstats = self.decode(gs.getAll())
+            except (xmlrpclib.Fault, ValueError):
+                allstats = None
+            if isinstance(allstats, dict):
+                for method in missing:
+                    if self.methodsplugins.get(method) in allstats:
+                        responses[method] = json.dumps(allstats[self.methodsplugins[method]])
+        if responses:
+            self.log(_("Batch grabbed methods: %s") % ", ".join(sorted(responses)))
+
+        # Fallback: one round trip per method, the streamed ones at last
+        # (a streamed response is read from the connection when checked)
+        for method in batch + [m for m in methods if m in self.streamedmethods]:
+            if method not in responses:
+                try:
+                    responses[method] = getattr(gs, method)()
+                except xmlrpclib.Fault as err:
+                    self.log(_("Can not run the Glances method: %s") % method)
+        return responses
+
+
     def check(self, host, warning, critical, **args):
         """
         INPUT
@@ -135,388 +979,2105 @@ class nagiosplugin(nagiospluginskeleton):
             self.exit('WARNING') if check is WARNING
             self.exit('CRITICAL') if check is WARNING
             self.exit('UNKNOWN') if check ERROR
+        With more than one stat (-s cpu,mem or -s all), warning and critical
+        are comma separated lists (one value per stat, empty for default),
+        the first line sums up all the stats and the worst status is returned
         """
 
-        # Connect to the Glances server
-        self.log(_("Check host: %s") % host)
-        if (args['password'] != ''):
-            gs = xmlrpclib.ServerProxy('http://%s:%s@%s:%d' % \
-                ('glances', args['password'], host, int(args['port'])))
-        else:
-            gs = xmlrpclib.ServerProxy('http://%s:%d' % (host, int(args['port'])))
-        self.log(_("Others args: %s") % args)
+        result = self.run(host, warning, critical, **args)
+        print(result.output())
+        self.exit(result.status)
+
 
-        # Test RCP server connection
-        remote_system = None
+    def run(self, host, warning = None, critical = None, **args):
+        """
+        Check host like check(), without printing or exiting
+        args: stat, statparam (default ''), port (default by API), password (default '')
+        Return a checkresult
+        Thread safe: the check is done by a worker() of the plugin, its
+        connections are given back to the shared pool (if any)
+        """
+        args.setdefault('statparam', '')
+        args.setdefault('password', '')
+        if args.get('port') is None:
+            args['port'] = 61208 if (self.api == 'rest') else 61209
+        plugin = self.worker()
         try:
-            # getSystem() was born in the 1.5.2 version of Glances
-            remote_system = gs.getSystem()
-            self.log(_("Info: remote system is: %s") % remote_system)
-        except xmlrpclib.Fault as err:
-            # getSystem method unknown ?... mmhhh...
-            self.log(_("Warning: %s works better with Glances server 1.5.2 or higher") % __appname__)
-            pass
-        except:
-            print(_("Connection to Glances server failed"))
-            self.exit('UNKNOWN')
+            try:
+                result = plugin.evaluate(host, warning, critical, **args)
+            except Exception as err:
+                # A check always gives a result (daemon, several hosts...)
+                result = checkresult('UNKNOWN', _("Check failed: %s") % err)
+            plugin.timer.phase(None)
+            plugin.logtimings(result.status)
+        finally:
+            plugin.release()
+        return result
+
+
+    def grab(self, host, stats, **args):
+        """
+        Grab the Glances responses needed by the (stat, param) list
+        Return a dict {method: JSON response}, or the UNKNOWN checkresult
+        if the Glances server can not be asked
+        """
+
+        methods = []
+        for stat, param in stats:
+            methods += [m for m in self.statsmethods[stat] if m not in methods]
+
+        self.server = (host, args['port'])
 
-        # DEBUG
-        # print gs.system.listMethods()
-        #~ print eval(gs.getSystem())
-        # END DEBUG
+        # Phases time of the check (-v, --timings, --timing-log)
+        self.timer = phasetimer(host = host, port = args['port'], stat = args['stat'],
+                                statparam = args.get('statparam', ''))
 
-        if (args['stat'] == "system"):
+        # Recorded responses (--replay): the Glances server is not asked
+        if self.replay is not None:
+            self.timer.phase('rpc')
+            responses = self.replay.load(host, args['port'], methods, self.streamedmethods)
+            if not responses:
+                return checkresult('UNKNOWN', _("No recorded responses of %s:%s in %s")
+                                   % (host, args['port'], self.replay.path))
+            return responses
 
-            # Get remote system information
+        self.timer.phase('connect')
+
+        # Connect to the Glances server
+        self.log(_("Check host: %s") % host)
+        gs = self.connect(host, args['port'], args['password'])
+        self.timer.watch(lambda: self.connecttime(gs))
+        # All the calls of the check share the --deadline time
+        self.transport(gs).deadline = None
+        if self.deadline is not None:
+            self.transport(gs).deadline = self.timer.start + self.deadline
+        self.log(_("Others args: %s") % args)
+        self.timer.phase('cache')
+
+        # Static metadata of the server (--metadata-ttl): the system and
+        # core count responses are not asked again at every check
+        metadata = {}
+        if self.metadata is not None:
+            metadata = self.metadata.get(host, args['port'])
+            self.log(_("Server metadata: %s") % metadata)
+        responses = dict([(m, metadata[m]) for m in self.metadatamethods
+                          if metadata.get(m) is not None])
+
+        # Responses grabbed by another check a few seconds ago (--cache-ttl)
+        # The host lock let only one check at a time ask the Glances server
+        lock = None
+        if self.cache is not None:
+            try:
+                lock = self.cache.lock(host, args['port'])
+            except (IOError, OSError) as err:
+                # Lock file replaced by a symbolic link: not followed
+                self.log(_("Can not lock the response cache: %s") % err)
+            responses.update(self.cache.get(host, args['port'],
+                [m for m in ['getSystem'] + methods if m not in responses]))
+            self.log(_("Cached methods: %s") % ", ".join(sorted(responses)))
+        breaker = None
+        try:
+            cached = responses.keys()
+
+            # Server failing again and again (--breaker-failures): not asked
+            # until the end of its cool-down period
+            if (self.breaker is not None) and \
+               ([m for m in methods if m not in responses] or
+                (not metadata and ('getSystem' not in responses))):
+                breaker = self.breaker.get(host, args['port'])
+                if self.breaker.wait(breaker):
+                    return checkresult('UNKNOWN', _("Glances server failed %d times, next try in %d seconds")
+                                       % (breaker['failures'], self.breaker.wait(breaker) + 1))
+
+            # Test RCP server connection
+            self.timer.phase('probe')
+            if not metadata and ('getSystem' not in responses):
+                try:
+                    # getSystem() was born in the 1.5.2 version of Glances
+                    responses['getSystem'] = gs.getSystem()
+                    self.log(_("Info: remote system is: %s") % responses['getSystem'])
+                except xmlrpclib.Fault as err:
+                    # getSystem method unknown ?... mmhhh...
+                    self.log(_("Warning: %s works better with Glances server 1.5.2 or higher") % __appname__)
+                    pass
+                except:
+                    return self.connectionfailed(gs, host, args['port'], breaker)
+
+            # DEBUG
+            # print gs.system.listMethods()
+            #~ print eval(gs.getSystem())
+            # END DEBUG
+
+            # Grab all the needed stats
+            self.timer.phase('rpc')
+            try:
+                # Only the checked instance (REST API), not kept in the cache
+                if (len(stats) == 1) and (stats[0][0] in self.statsinstances) \
+                   and isinstance(gs, glancesrest) and not self.ispattern(stats[0][1]):
+                    method, key = self.statsinstances[stats[0][0]]
+                    name = stats[0][1]
+                    if stats[0][0] in ('fs', 'fsforecast'):
+                        name = self.mountpoint(name)
+                    selected = gs.select(method, key, name)
+                    if selected is not None:
+                        self.log(_("Server side selection: %s") % selected)
+                        responses[method] = selected
+                        cached.append(method)
+                responses.update(self.fetch(gs, [m for m in methods if m not in responses],
+                                            metadata.get('methods')))
+            except:
+                if self.metadata is not None:
+                    self.metadata.invalidate(host, args['port'])
+                return self.connectionfailed(gs, host, args['port'], breaker)
+            if breaker is not None:
+                self.breaker.success(host, args['port'])
+
+            self.timer.phase('cache')
+            if self.cache is not None:
+                self.cache.put(host, args['port'],
+                               dict([(m, r) for m, r in responses.items()
+                                     if (m not in cached) and isinstance(r, basestring)]))
+        finally:
+            if lock is not None:
+                lock.close()
+
+        # Raw responses kept for a replay (--record): the first reading
+        if self.record is not None:
             try:
-                # {"platform": "32bit", "os_name": "Windows", "hr_name": "Windows 7 SP1 32bit", "hostname": "sim-vm", "os_version": "7 SP1"}
-                remote_system = json.loads(remote_system)
-                print(_("%s: %s (%s - %s - %s)") % (
-                    remote_system["hostname"],
-                    remote_system["hr_name"],
-                    remote_system["os_name"],
-                    remote_system["os_version"],
-                    remote_system["platform"]
-                ))
-            except xmlrpclib.Fault as err:
-                print(_("Bad formed Glances server response: %s") % remote_system)
-                self.exit('UNKNOWN')
+                responses = self.record.save(host, args['port'], responses)
+            except (IOError, OSError) as err:
+                # Not in the plugin output (first line for Nagios)
+                sys.stderr.write(_("Can not record the responses: %s") % err + "\n")
+
+        # More readings on the same connection (--samples)
+        if (self.samples > 1):
+            responses = self.sample(gs, responses, methods, metadata.get('methods'))
+
+        # Update the server metadata, forget them if the server has changed
+        self.timer.phase('probe')
+        if self.metadata is not None:
+            if [m for m in methods if m not in responses]:
+                self.metadata.invalidate(host, args['port'])
+            elif not metadata:
+                self.metadata.put(host, args['port'], self.discover(gs, responses))
+            elif [m for m in self.metadatamethods
+                  if (metadata.get(m) is None) and (m in responses)]:
+                metadata.update([(m, responses[m]) for m in self.metadatamethods
+                                 if m in responses])
+                self.metadata.put(host, args['port'], metadata)
+
+        return responses
+
+
+    def sample(self, gs, responses, methods, capabilities = None):
+        """
+        Read samples - 1 more times the methods of the varying stats, every
+        interval seconds on the gs connection (not more than the --deadline)
+        capabilities: the system.listMethods() list if known (see fetch())
+        Return the responses, the statistic of the readings for these methods
+        """
+        sampled = [m for m in methods if (m in responses) and (m not in self.streamedmethods)
+                   and (m not in self.metadatamethods)]
+        if not sampled:
+            return responses
+        responses = dict(responses)
+        # The streamed responses are read before the connection is used again
+        for method in self.streamedmethods:
+            if (method in responses) and not isinstance(responses[method], basestring):
+                try:
+                    responses[method] = "".join(responses[method])
+                except (socket.error, httplib.HTTPException) as err:
+                    self.log(_("Can not read the Glances method %s: %s") % (method, err))
+                    del responses[method]
+        readings = [dict([(m, self.decode(responses[m])) for m in sampled])]
+        previous = self.timer.phase('sample')
+        try:
+            while (len(readings) < self.samples):
+                if (self.deadline is not None) and \
+                   (monotonic() + self.interval > self.timer.start + self.deadline):
+                    self.log(_("Sampling stopped by the deadline"))
+                    break
+                time.sleep(self.interval)
+                self.timer.phase('rpc')
+                try:
+                    fetched = self.fetch(gs, sampled, capabilities)
+                except Exception as err:
+                    # Evaluated on the readings already done
+                    self.log(_("Sampling stopped: %s") % err)
+                    break
+                finally:
+                    self.timer.phase('sample')
+                readings.append(dict([(m, self.decode(r)) for m, r in fetched.items()]))
+        finally:
+            self.timer.phase(previous)
+        self.log(_("%d readings, %s of the values") % (len(readings), self.statistic))
+        for method in sampled:
+            responses[method] = json.dumps(self.aggregate([r[method] for r in readings if method in r]))
+        return responses
+
+
+    def aggregate(self, readings, reverse = False):
+        """
+        Return the statistic (--statistic) of the numeric values of the
+        readings of a response, matched by key (list items: by their 'key' field)
+        The other values are the ones of the first reading
+        reverse: max is the minimum, p95 the 5th percentile (see samplesreversed)
+        """
+        first = readings[0]
+        if isinstance(first, dict):
+            return dict([(key, self.aggregate([r[key] for r in readings if isinstance(r, dict) and key in r],
+                                              key in self.samplesreversed))
+                         for key in first])
+        if isinstance(first, list):
+            keyname = first[0].get('key') if (first and isinstance(first[0], dict)) else None
+            if keyname is None:
+                # Matched by position
+                return [self.aggregate([r[i] for r in readings if isinstance(r, list) and i < len(r)])
+                        for i in range(len(first))]
+            items = {}
+            for reading in readings:
+                for item in reading:
+                    items.setdefault(item.get(keyname), []).append(item)
+            return [self.aggregate(items[item.get(keyname)]) for item in first]
+        values = [r for r in readings if isinstance(r, (int, long, float)) and not isinstance(r, bool)]
+        if isinstance(first, bool) or (len(values) != len(readings)) or (min(values) == max(values)):
+            # Not numeric or constant (integers stay integers)
+            return first
+        if (self.statistic == 'mean'):
+            return sum(values) / float(len(values))
+        if (self.statistic == 'max'):
+            return min(values) if reverse else max(values)
+        return percentile(sorted(values), 5 if reverse else 95)
+
+
+    def evaluate(self, host, warning, critical, **args):
+        """
+        Grab the Glances responses and eval the stats (see run())
+        Return a checkresult
+        """
 
-            self.exit('OK')
+        stats = self.parsestats(args['stat'], args.get('statparam', ''))
+        for stat, param in stats:
+            if stat not in self.statslist:
+                return checkresult('UNKNOWN', _("Unknown stat: %s") % stat)
+        responses = self.grab(host, stats, **args)
+        if isinstance(responses, checkresult):
+            return responses
+
+        self.timer.phase('check')
+        if (len(stats) == 1):
+            # Only one stat: standard Nagios plugin output
+            stat, param = stats[0]
+            status, message, perfdata = self.checkstat(stat, param, responses, warning, critical)
+            self.pushmetrics(host, [(stat, param, perfdata)], responses)
+            self.timer.phase('output')
+            return checkresult(status, message, perfdata + self.timingsperfdata())
+
+        # Several stats: worst status first, then one line per stat
+        warnings = str(warning or "").split(",")
+        criticals = str(critical or "").split(",")
+        results = []
+        for i, (stat, param) in enumerate(stats):
+            w = warnings[i] if (i < len(warnings) and warnings[i] != "") else None
+            c = criticals[i] if (i < len(criticals) and criticals[i] != "") else None
+            try:
+                results.append((stat, param) + self.checkstat(stat, param, responses, w, c))
+            except Exception as err:
+                # One failing stat does not hide the others
+                results.append((stat, param, 'UNKNOWN',
+                                _("Can not check the stat: %s") % err, []))
+        self.pushmetrics(host, [(r[0], r[1], r[4]) for r in results], responses)
+        self.timer.phase('output')
+        worst = max([r[2] for r in results], key = lambda s: self.return_codes[s])
+        names = [("%s:%s" % (r[0], r[1]) if r[1] else r[0]) for r in results]
+        summary = _("%s - %d stats checked: %s") % (
+            worst, len(results),
+            ", ".join(["%s %s" % (n, r[2]) for n, r in zip(names, results)]))
+        perfdata = []
+        for name, r in zip(names, results):
+            # Instances perfdata are already prefixed by the instance name
+            if self.ispattern(r[1]):
+                name = r[0]
+            perfdata += [("%s_%s" % (name, label), value) for label, value in r[4]]
+        perfdata += self.timingsperfdata()
+        return checkresult(worst, summary, perfdata,
+                           [checkresult(r[2], r[3], r[4], name = name) for name, r in zip(names, results)])
+
+
+    def parsehosts(self, host):
+        """
+        Split a -H value into a list of hosts
+        'host1,host2' => ['host1', 'host2']
+        '@/path/hosts' => one host per line of the file (# for comments)
+        """
+        if host.startswith("@"):
+            f = open(host[1:])
+            try:
+                lines = [l.split("#")[0].strip() for l in f]
+            finally:
+                f.close()
+            return [l for l in lines if l != ""]
+        return [h.strip() for h in host.split(",") if h.strip() != ""]
 
 
-        elif (args['stat'] == "uptime"):
+    def checkhosts(self, hosts, warning, critical, workers = 16, service = None, **args):
+        """
+        Run check() on all the hosts, workers hosts at a time
+        Return a list of (host, service, return code, output, start, finish) tuples
+        """
+        if service is None:
+            service = args['stat']
+            if args.get('statparam'):
+                service += " " + args['statparam']
 
-            # Get and eval uptime stat
+        def checkhost(host):
+            start = time.time()
             try:
-                uptime = json.loads(gs.getUptime())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getUptim"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(_("Uptime: %s") % uptime)
+                result = self.run(host, warning, critical, **args)
+            except Exception as err:
+                result = checkresult('UNKNOWN', _("Check failed: %s") % err)
+            self.log(_("Host %s checked in %.3f seconds") % (host, time.time() - start))
+            return (host, service, result.code(), result.output(), start, time.time())
+
+        import multiprocessing.pool
+        pool = multiprocessing.pool.ThreadPool(max(1, min(workers, len(hosts))))
+        try:
+            return pool.map(checkhost, hosts)
+        finally:
+            pool.close()
 
-            if not uptime:
-                print(_("No uptime information available from host"))
-                self.exit('UNKNOWN')
 
-            uptime_s = time.strptime(uptime, "%H:%M:%S")
-            self.log(_("Uptime: %s") % uptime_s)
+    def checkstat(self, stat, statparam, responses, warning, critical):
+        """
+        Eval one stat from the Glances responses grabbed by fetch()
+        Return a (status, message, perfdata) tuple
+        perfdata is a list of (label, value) tuples
+        """
+        if (warning is not None) or (critical is not None):
+            self.log(_("Stat %s: warning %s, critical %s") % (stat, warning, critical))
+        status, message, perfdata = getattr(self, "check_%s" % stat)(responses, warning, critical, statparam)
+        # The instances perfdata are selected by checkinstances()
+        if stat not in self.statsinstances:
+            perfdata = self.selectperfdata(perfdata)
+        return (status, message, perfdata)
 
-            if (warning is None): warning = 15 * 60
-            if (critical is None): critical = 5 * 60
-            seconds = uptime_s.tm_hour * 3600 + uptime_s.tm_min * 60 + uptime_s.tm_sec
 
-            # Plugin output
-            checked_message = _("System uptime: %s (%d seconds)") % (uptime, seconds)
-            # Performance data
-            checked_message += _(" | 'uptime'=%ds;;;%s;%s") % (seconds, warning, critical)
-
-            # Display the message
-            self.log(_("Warning threshold: %s" % warning))
-            self.log(_("Critical threshold: %s" % critical))
-            print(checked_message)
-
-            # Return code
-            if (seconds < int(critical)):
-                self.exit('CRITICAL')
-            elif (seconds < int(warning)):
-                self.exit('WARNING')
-            else:
-                self.exit('OK')
+    def index(self, responses, method, key):
+        """
+        Return the {key value: entry} index of a list response (net, diskio, fs)
+        or of the containers of the docker response
+        Built once per response
+        """
+        response = responses[method]
+        if (method not in self.indexes) or (self.indexes[method][0] is not response):
+            entries = self.decode(response)
+            if isinstance(entries, dict):
+                # Docker: {'version': {...}, 'containers': [...]}
+                entries = entries.get('containers') or []
+            self.indexes[method] = (response, dict([(entry[key], entry) for entry in entries]))
+        return self.indexes[method][1]
 
 
-        elif (args['stat'] == "cpu"):
+    def ispattern(self, pattern):
+        return pattern.startswith("re:") or any([c in pattern for c in "*?["])
 
-            # Get and eval CPU stat
 
+    def selectinstances(self, index, pattern):
+        """
+        Return the entries of index whose name matches pattern:
+        a name (eth0), a glob (eth*, * for all) or a regex (re:^eth[0-9]$)
+        """
+        if pattern.startswith("re:"):
             try:
-                cpu = json.loads(gs.getCpu())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getCpu"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(cpu)
-            #~ print cpu
-            #~ If user|kernel|nice CPU is > 70%, then status is set to "WARNING".
-            #~ If user|kernel|nice CPU is > 90%, then status is set to "CRITICAL".
-            if (warning is None): warning = 70
-            if (critical is None): critical = 90
-            checked_value = 100 - cpu['idle']
-            # Plugin output
-            checked_message = _("CPU consumption: %.2f%%") % checked_value
-            # Performance data
-            checked_message += _(" | 'percent'=%.2f;0;100;%s;%s") % (checked_value, warning, critical)
-            for key in cpu:
-                checked_message += " '%s'=%.2f" % (key, cpu[key])
+                regex = re.compile(pattern[3:])
+            except re.error:
+                return []
+            names = [name for name in index if regex.search(name)]
+        elif self.ispattern(pattern):
+            import fnmatch
+            names = fnmatch.filter(index, pattern)
+        else:
+            return [index[pattern]] if pattern in index else []
+        return [index[name] for name in sorted(names)]
 
 
-        elif (args['stat'] == "load"):
+    def checkinstances(self, message, results, pattern, warning, critical, reverse = False):
+        """
+        Eval the (name, checked value, perfdata) results of the instances
+        selected by pattern, return a (status, message, perfdata) tuple
+        message: format of the checked value, or function returning the text
+        A name: the instance message and perfdata
+        A pattern: the worst instance message, the perfdata of all the instances
+        reverse: the lower the value, the worse (see threshold())
+        """
+        if not callable(message):
+            message = message.__mod__
+        statuses = [self.threshold(value, warning, critical, reverse)
+                    for name, value, perfdata in results]
+        if not self.ispattern(pattern):
+            return (statuses[0], message(results[0][1]), self.selectperfdata(results[0][2]))
+        worst = max(range(len(results)),
+                    key = lambda i: (self.return_codes[statuses[i]],
+                                     -results[i][1] if reverse else results[i][1]))
+        message = message(results[worst][1]) + \
+            _(" on %s (%d matching %s)") % (results[worst][0], len(results), pattern)
+        perfdata = [("%s_%s" % (name, label), data)
+                    for name, value, instanceperfdata in results
+                    for label, data in self.selectperfdata(instanceperfdata)]
+        return (statuses[worst], message, perfdata)
+
+
+    def perfdata(self, stat, entry, thresholds = None):
+        """
+        Return the perfdata of the numeric values of a Glances response entry,
+        (key, 'value[UOM];[warning];[critical];[min];[max]') tuples sorted by key
+        with the unit, min and max of perfdataunits
+        thresholds: {key: (warning, critical)} of the checked values
+        """
+        def number(value):
+            return ("%d" if isinstance(value, (int, long)) else "%.2f") % value
+
+        units = {}
+        for keys, unit, minimum, maximum in self.perfdataunits.get(stat, ()):
+            units.update([(key, (unit, minimum, maximum)) for key in keys])
+        thresholds = thresholds or {}
+        perfdata = []
+        for key in sorted(entry):
+            value = entry[key]
+            if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+                continue
+            unit, minimum, maximum = units.get(key, ('', None, None))
+            if isinstance(maximum, basestring):
+                maximum = entry.get(maximum)
+            warning, critical = thresholds.get(key, (None, None))
+            fields = [number(value) + unit, warning, critical,
+                      None if minimum is None else number(minimum),
+                      None if maximum is None else number(maximum)]
+            perfdata.append((key, ";".join(["" if f is None else "%s" % f for f in fields]).rstrip(";")))
+        return perfdata
+
+
+    def selectperfdata(self, perfdata):
+        """
+        Return the perfdata whose label matches --perfdata-keys (all without it)
+        """
+        if self.perfdatakeys is None:
+            return perfdata
+        import fnmatch
+        return [(label, value) for label, value in perfdata
+                if [pattern for pattern in self.perfdatakeys if fnmatch.fnmatchcase(label, pattern)]]
 
-            # Get and eval CORE and LOAD stat
 
-            try:
-                # Glances v2
-                core = eval(gs.getCore(), {'null': None})["log"]
-            except KeyError:
-                # Glances v1
-                core = eval(gs.getCore(), {'null': None})
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getLoad"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(_("Core: %d") % core)
-            try:
-                load = eval(gs.getLoad(), {'null': None})
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getLoad"))
-                self.exit('UNKNOWN')
+    def perfvalue(self, value):
+        """
+        Return the number of a perfdata value ('12.5%;70;90' => 12.5), None if not numeric
+        """
+        number = re.match(r"-?[0-9]+(\.[0-9]*)?([eE][-+]?[0-9]+)?(?=[a-zA-Z%]*(;|$))", value)
+        return float(number.group(0)) if number else None
+
+
+    def series(self, stat, param, perfdata, responses):
+        """
+        Split the perfdata of a stat by instance, numeric values only
+        Return a [(instance, [(label, value)])] list ('' instance: not a net, diskio or fs stat)
+        """
+        values = [(label, self.perfvalue(value)) for label, value in perfdata]
+        values = [(label, value) for label, value in values if value is not None]
+        if not values:
+            return []
+        if stat not in self.statsinstances:
+            return [("", values)]
+        if not self.ispattern(param):
+            return [(self.mountpoint(param) if stat in ('fs', 'fsforecast') else param, values)]
+        # A pattern: the labels are prefixed by the instance name (see checkinstances())
+        method, key = self.statsinstances[stat]
+        names = sorted(self.index(responses, method, key), key = len, reverse = True)
+        instances = {}
+        for label, value in values:
+            for name in names:
+                if label.startswith(name + "_"):
+                    instances.setdefault(name, []).append((label[len(name) + 1:], value))
+                    break
+        return sorted(instances.items())
+
+
+    def check_system(self, responses, warning, critical, statparam):
+
+        # Get remote system information
+        remote_system = responses.get('getSystem')
+        try:
+            # {"platform": "32bit", "os_name": "Windows", "hr_name": "Windows 7 SP1 32bit", "hostname": "sim-vm", "os_version": "7 SP1"}
+            remote_system = self.decode(remote_system)
+            return ('OK', _("%s: %s (%s - %s - %s)") % (
+                remote_system["hostname"],
+                remote_system["hr_name"],
+                remote_system["os_name"],
+                remote_system["os_version"],
+                remote_system["platform"]
+            ), [])
+        except (TypeError, ValueError, KeyError):
+            return ('UNKNOWN', _("Bad formed Glances server response: %s") % remote_system, [])
+
+
+    def check_uptime(self, responses, warning, critical, statparam):
+
+        # Get and eval uptime stat
+        if 'getUptime' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getUptime"), [])
+        uptime = self.decode(responses['getUptime'])
+        self.log(_("Uptime: %s") % uptime)
+
+        if not uptime:
+            return ('UNKNOWN', _("No uptime information available from host"), [])
+
+        #~ Uptime is "H:MM:SS" or "N day(s), H:MM:SS"
+        try:
+            days = 0
+            if ',' in uptime:
+                days, uptime_hms = uptime.split(',', 1)
+                days = int(days.split()[0])
             else:
-                self.log(_("Load: %s") % load)
-
-            if not load:
-                print(_("No load information available from host"))
-                self.exit('UNKNOWN')
-
-            #~ If average load is > 1*Core, then status is set to "WARNING".
-            #~ If average load is > 5*Core, then status is set to "CRITICAL".
-            if (warning is None): warning = 1
-            if (critical is None): critical = 5
-            warning *= core
-            critical *= core
-            checked_value = load['min5']
-            # Plugin output
-            checked_message = _("LOAD last 5 minutes: %.2f") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in load:
-                if (key == "min5"):
-                    checked_message += " '%s'=%.2f;%s;%s" % (key, load[key], warning, critical)
-                else:
-                    checked_message += " '%s'=%.2f" % (key, load[key])
+                uptime_hms = uptime
+            hours, minutes, secs = [int(float(v)) for v in uptime_hms.strip().split(':')]
+        except ValueError:
+            return ('UNKNOWN', _("Bad formed Glances server response: %s") % uptime, [])
 
+        if (warning is None): warning = 15 * 60
+        if (critical is None): critical = 5 * 60
+        seconds = ((days * 24 + hours) * 60 + minutes) * 60 + secs
 
-        elif (args['stat'] == "mem"):
+        # Plugin output
+        checked_message = _("System uptime: %s (%d seconds)") % (uptime, seconds)
+        # Performance data (lower is worse: alert ranges, see threshold())
+        perfdata = [('uptime', "%ds;%s:;%s:;0" % (seconds, warning, critical))]
 
-            # Get and eval MEM stat
-            try:
-                mem = json.loads(gs.getMem())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getMem"))
-                self.exit('UNKNOWN')
+        # Return code
+        if (seconds < int(critical)):
+            return ('CRITICAL', checked_message, perfdata)
+        elif (seconds < int(warning)):
+            return ('WARNING', checked_message, perfdata)
+        else:
+            return ('OK', checked_message, perfdata)
+
+
+    def check_cpu(self, responses, warning, critical, statparam):
+
+        # Get and eval CPU stat
+        if 'getCpu' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getCpu"), [])
+        cpu = self.decode(responses['getCpu'])
+        self.log(cpu)
+        #~ If user|kernel|nice CPU is > 70%, then status is set to "WARNING".
+        #~ If user|kernel|nice CPU is > 90%, then status is set to "CRITICAL".
+        if (warning is None): warning = 70
+        if (critical is None): critical = 90
+        checked_value = 100 - cpu['idle']
+        # Plugin output
+        checked_message = _("CPU consumption: %.2f%%") % checked_value
+        # Performance data
+        cpu['percent'] = checked_value
+        perfdata = self.perfdata('cpu', cpu, {'percent': (warning, critical)})
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def check_percpu(self, responses, warning, critical, statparam):
+
+        # Get and eval the busiest core (-e cores: also the perfdata of each core)
+        if 'getPerCpu' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getPerCpu"), [])
+        if statparam not in ('', 'cores'):
+            return ('UNKNOWN', _("Use -e cores to add the perfdata of each core"), [])
+        percpu = self.decode(responses['getPerCpu'])
+        if not percpu:
+            return ('UNKNOWN', _("No per core CPU information available from host"), [])
+        #~ If a core is > 90%, then status is set to "WARNING".
+        #~ If a core is > 99%, then status is set to "CRITICAL".
+        if (warning is None): warning = 90
+        if (critical is None): critical = 99
+        busy = [100 - core['idle'] if ('idle' in core) else core['total'] for core in percpu]
+        summary = corestats(busy, float(warning), len(busy) >= self.vectorizecores)
+        busiest = percpu[summary.pop('argmax')].get('cpu_number', '?')
+        # Plugin output
+        checked_message = _("Busiest core: %.2f%% on cpu%s (%d/%d cores >= %s%%, mean %.2f%%)") % (
+            summary['max'], busiest, summary['above'], summary['cores'], warning, summary['mean'])
+        # Performance data (summary only: the same size whatever the core count)
+        perfdata = self.perfdata('percpu', summary, {'max': (warning, critical)})
+        if (statparam == 'cores'):
+            perfdata += [("cpu%s" % core.get('cpu_number', i), "%.2f%%;%s;%s;0;100" % (value, warning, critical))
+                         for i, (core, value) in enumerate(zip(percpu, busy))]
+        return (self.threshold(summary['max'], warning, critical), checked_message, perfdata)
+
+
+    def check_load(self, responses, warning, critical, statparam):
+
+        # Get and eval CORE and LOAD stat
+        if 'getCore' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getCore"), [])
+        core = self.decode(responses['getCore'], lambda r: eval(r, {'null': None}))
+        try:
+            # Glances v2
+            core = core["log"]
+        except TypeError:
+            # Glances v1
+            pass
+        self.log(_("Core: %d") % core)
+        if 'getLoad' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getLoad"), [])
+        load = self.decode(responses['getLoad'], lambda r: eval(r, {'null': None}))
+        self.log(_("Load: %s") % load)
+
+        if not load:
+            return ('UNKNOWN', _("No load information available from host"), [])
+
+        #~ If average load is > 1*Core, then status is set to "WARNING".
+        #~ If average load is > 5*Core, then status is set to "CRITICAL".
+        if (warning is None): warning = 1
+        if (critical is None): critical = 5
+        warning = float(warning) * core
+        critical = float(critical) * core
+        checked_value = load['min5']
+        # Plugin output
+        checked_message = _("LOAD last 5 minutes: %.2f") % checked_value
+        # Performance data
+        perfdata = self.perfdata('load', load, {'min5': (warning, critical)})
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def check_mem(self, responses, warning, critical, statparam):
+
+        # Get and eval MEM stat
+        if 'getMem' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getMem"), [])
+        mem = self.decode(responses['getMem'])
+        self.log(mem)
+        #~ If memory is > 70%, then status is set to "WARNING".
+        #~ If memory is > 90%, then status is set to "CRITICAL"
+        if (warning is None): warning = 70
+        if (critical is None): critical = 90
+        checked_value = mem['percent']
+        # Plugin output
+        checked_message = _("MEM consumption: %.2f%%") % checked_value
+        # Performance data
+        perfdata = self.perfdata('mem', mem, {'percent': (warning, critical)})
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def check_swap(self, responses, warning, critical, statparam):
+
+        # Get and eval MEM stat
+        if 'getMemSwap' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getMemSwap"), [])
+        swap = self.decode(responses['getMemSwap'])
+        self.log(swap)
+        #~ If memory is > 70%, then status is set to "WARNING".
+        #~ If memory is > 90%, then status is set to "CRITICAL"
+        if (warning is None): warning = 70
+        if (critical is None): critical = 90
+        checked_value = swap['percent']
+        # Plugin output
+        checked_message = _("SWAP consumption: %.2f%%") % checked_value
+        # Performance data
+        perfdata = self.perfdata('swap', swap, {'percent': (warning, critical)})
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def check_process(self, responses, warning, critical, statparam):
+
+        # Get and eval Process stat
+        if 'getProcessCount' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getProcessCount"), [])
+        process = self.decode(responses['getProcessCount'])
+        self.log(process)
+        #~ If running process is > 50, then status is set to "WARNING".
+        #~ If running process is > 100, then status is set to "CRITICAL"
+        if (warning is None): warning = 50
+        if (critical is None): critical = 100
+        checked_value = process['running']
+        # Plugin output
+        checked_message = _("Running processes: %d") % checked_value
+        # Performance data
+        perfdata = self.perfdata('process', process, {'running': (warning, critical)})
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def check_net(self, responses, warning, critical, statparam):
+
+        # Get and eval Network stat
+        if 'getNetwork' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getNetwork"), [])
+        net = self.index(responses, 'getNetwork', 'interface_name')
+        self.log(net)
+        #~ If net[param] > 60 Mbps, then status is set to "WARNING".
+        #~ If net[param] > 80 Mbps, then status is set to "CRITICAL"
+        # Values are in Kbyte/second
+        if (warning is None): warning = 7500000
+        if (critical is None): critical = 10000000
+        results = []
+        # Rates (--rates): bytes per second since the previous check
+        rx, tx = ('rx_rate', 'tx_rate') if self.userates else ('rx', 'tx')
+        if self.userates and (self.rates is None):
+            return ('UNKNOWN', _("Can not keep the counters of the rates: %s") % self.cacheerror, [])
+        for interface in self.selectinstances(net, statparam):
+            if self.userates:
+                interface = self.counterrates('net', interface['interface_name'], interface)
+            checked_value = max(interface[tx], interface[rx])
+            # Performance data
+            perfdata = self.perfdata('net', interface, {rx: (warning, critical),
+                                                        tx: (warning, critical)})
+            results.append((interface['interface_name'], checked_value, perfdata))
+        if not results:
+            return ('UNKNOWN', _("Unknown network interface: %s") % statparam, [])
+        # Plugin output
+        message = _("Network rate: %d B/s") if self.userates else _("Network rate: %d")
+        return self.checkinstances(message, results, statparam, warning, critical)
+
+
+    def check_diskio(self, responses, warning, critical, statparam):
+
+        # Get and eval Network stat
+        if 'getDiskIO' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getDiskIO"), [])
+        diskio = self.index(responses, 'getDiskIO', 'disk_name')
+        self.log(diskio)
+
+        #~ If diskio[param] > 30 Mbytes/sec, then status is set to "WARNING".
+        #~ If diskio[param] > 40 MBytes/sec, then status is set to "CRITICAL"
+        if (warning is None): warning = 30000000
+        if (critical is None): critical = 40000000
+        results = []
+        for disk in self.selectinstances(diskio, statparam):
+            if self.userates:
+                # Rates (--rates): the reads and the writes, in bytes per second
+                disk = self.counterrates('diskio', disk['disk_name'], disk)
+                checked_value = max(disk["read_rate"], disk["write_rate"])
+                thresholds = {'read_rate': (warning, critical), 'write_rate': (warning, critical)}
             else:
-                self.log(mem)
-            #~ If memory is > 70%, then status is set to "WARNING".
-            #~ If memory is > 90%, then status is set to "CRITICAL"
-            if (warning is None): warning = 70
-            if (critical is None): critical = 90
-            checked_value = mem['percent']
-            # Plugin output
-            checked_message = _("MEM consumption: %.2f%%") % checked_value
+                # checked_value = max(disk["read_bytes"], disk["write_bytes"])
+                checked_value = disk["read_bytes"]
+                thresholds = {'read_bytes': (warning, critical)}
             # Performance data
-            checked_message += _(" |")
-            for key in mem:
-                if (key == "min5"):
-                    checked_message += " '%s'=%.2f;%s;%s" % (key, mem[key], warning, critical)
-                else:
-                    checked_message += " '%s'=%.2f" % (key, mem[key])
+            perfdata = self.perfdata('diskio', disk, thresholds)
+            results.append((disk['disk_name'], checked_value, perfdata))
+        if not results:
+            return ('UNKNOWN', _("Unknown disk: %s") % statparam, [])
+        # Plugin output
+        message = _("Disk IO: %d B/s") if self.userates else _("Disk IO: %d")
+        return self.checkinstances(message, results, statparam, warning, critical)
+
+
+    def counterrates(self, stat, name, entry):
+        """
+        Return a copy of the net or diskio entry with the per second rates of
+        ratescounters (--rates): from the cumulative counters and their reading
+        by the previous check, else (first check, reset, no cumulative counter)
+        from the deltas over the server refresh period (time_since_update)
+        """
+        fields = self.ratescounters[stat]
+        entry = dict(entry)
+        rates = None
+        # The diskio rates have no cumulative counter (no counterstate needed)
+        if (self.rates is not None) and \
+           not [counter for rate, counter, delta in fields if entry.get(counter) is None]:
+            host, port = self.server
+            rates = self.rates.rates(host, port, "%s:%s" % (stat, name),
+                                     [entry[counter] for rate, counter, delta in fields])
+        if rates is None:
+            seconds = entry.get('time_since_update') or 0
+            rates = [(entry.get(delta) or 0) / float(seconds) if (seconds > 0) else (entry.get(delta) or 0)
+                     for rate, counter, delta in fields]
+        entry.update(zip([rate for rate, counter, delta in fields], rates))
+        return entry
+
+
+    def check_topproc(self, responses, warning, critical, statparam):
+
+        # Get and eval the top processes (-e <cpu|mem|io>[:<number>])
+        if 'getProcessList' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getProcessList"), [])
+        key, sep, number = statparam.partition(":")
+        key = key or 'cpu'
+        if (key not in self.topprockeys) or not (number or "5").isdigit():
+            return ('UNKNOWN', _("Use -e with value in %s (and :<number of processes>)")
+                    % ", ".join(self.topprockeys), [])
+        number = max(1, int(number or 5))
+        #~ If the top process CPU is > 80%, then status is set to "WARNING".
+        #~ If the top process CPU is > 95%, then status is set to "CRITICAL"
+        #~ Memory: 50% / 80%, IO: 30 / 40 MBytes/sec
+        defaults = {'cpu': (80, 95), 'mem': (50, 80), 'io': (30000000, 40000000)}
+        if (warning is None): warning = defaults[key][0]
+        if (critical is None): critical = defaults[key][1]
+
+        def value(process):
+            if (key == 'cpu'):
+                return process.get('cpu_percent') or 0
+            elif (key == 'mem'):
+                return process.get('memory_percent') or 0
+            # io_counters: [read_bytes, write_bytes, read_bytes_old, write_bytes_old, tag]
+            io = process.get('io_counters') or [0, 0, 0, 0, 0]
+            if not process.get('time_since_update') or (len(io) < 4):
+                return 0
+            return (io[0] - io[2] + io[1] - io[3]) / process['time_since_update']
+
+        # Only the top processes are kept while the response is decoded
+        response = responses['getProcessList']
+        chunks = [response] if isinstance(response, basestring) else response
+        import heapq
+        # A streamed response is read while decoded: timed in the decode phase
+        previous = self.timer.phase('decode')
+        try:
+            top = heapq.nlargest(number, ((value(p), p.get('pid'), p.get('name'))
+                                          for p in iterjsonarray(chunks)))
+        except ValueError as err:
+            return ('UNKNOWN', _("Bad formed Glances server response: %s") % err, [])
+        except (socket.error, httplib.HTTPException, xmlrpclib.Error) as err:
+            # Streamed response: connection lost or --deadline exceeded
+            return ('UNKNOWN', _("Connection to Glances server failed: %s") % err, [])
+        finally:
+            self.timer.phase(previous)
+        if not top:
+            return ('UNKNOWN', _("No process information available from host"), [])
+
+        units = {'cpu': '%', 'mem': '%', 'io': 'B'}
+        checked_value = top[0][0]
+        # Plugin output
+        checked_message = _("Top %d processes by %s: %s") % (len(top), key, ", ".join(
+            ["%s (%s) %.2f%s" % (name, pid, v, "%" if (key != 'io') else "B/s")
+             for v, pid, name in top]))
+        # Performance data (by rank: the processes change between checks)
+        perfdata = [("top%d" % (i + 1), "%.2f%s;%s;%s" % (v, units[key], warning, critical))
+                    for i, (v, pid, name) in enumerate(top)]
+        return (self.threshold(checked_value, warning, critical), checked_message, perfdata)
+
+
+    def mountpoint(self, statparam):
+        mnt_point = statparam
+        # If the FS looks like it is a Windows drive, automatically add the Windows slash
+        if not statparam.startswith(("/", "re:")) and not statparam.endswith("\\"):
+                mnt_point = statparam.replace(":",":\\")
+        return mnt_point
+
+
+    def check_fs(self, responses, warning, critical, statparam):
+
+        # Get and eval Network stat
+        if 'getFs' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getFs"), [])
+        fs = self.index(responses, 'getFs', 'mnt_point')
+        self.log(fs)
+        #~ If fs[param] > %, then status is set to "WARNING".
+        #~ If fs[param] > %, then status is set to "CRITICAL"
+        if (warning is None): warning = 70
+        if (critical is None): critical = 90
+        mnt_point = self.mountpoint(statparam)
+        results = []
+        for disk in self.selectinstances(fs, mnt_point):
+            checked_value = disk["percent"]
+            # Performance data
+            # (pctfree: the used space, as in the first versions)
+            perfdata = self.perfdata('fs', dict(disk, pctfree = checked_value),
+                                     {'pctfree': (warning, critical)})
+            results.append((disk['mnt_point'], checked_value, perfdata))
+        if not results:
+            return ('UNKNOWN', _("Unknown mounting point: %s") % statparam, [])
+        # Plugin output
+        return self.checkinstances(_("FS using space: %d%%"), results, statparam, warning, critical)
+
+
+    def check_fsforecast(self, responses, warning, critical, statparam):
+
+        # Get the FS stat, keep it in the history and forecast when it is full
+        if 'getFs' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getFs"), [])
+        if (self.history is None) and (self.cacheerror is not None):
+            return ('UNKNOWN', _("Can not keep the metrics history: %s") % self.cacheerror, [])
+        if self.history is None:
+            return ('UNKNOWN', _("The FS forecast needs the metrics history (--history)"), [])
+        fs = self.index(responses, 'getFs', 'mnt_point')
+        #~ If the FS is full in less than 48 hours, then status is set to "WARNING".
+        #~ If the FS is full in less than 12 hours, then status is set to "CRITICAL"
+        if (warning is None): warning = 48
+        if (critical is None): critical = 12
+        mnt_point = self.mountpoint(statparam)
+        host, port = self.server
+        results = []
+        for disk in self.selectinstances(fs, mnt_point):
+            samples = self.history.append(host, port, "fs:%s" % disk['mnt_point'], disk["percent"])
+            hours = self.history.forecast(samples, 100.0)
+            self.log(_("FS %s: %d samples, full in %s hours") % (disk['mnt_point'], len(samples) // 2, hours))
+            # Performance data (U: not filling up, lower is worse: alert ranges)
+            perfdata = [('hours', "%s;%s:;%s:;0" % ("U" if hours == float('inf') else "%.1f" % hours,
+                                                    warning, critical)),
+                        ('percent', "%s%%;;;0;100" % disk["percent"]),
+                        ('samples', "%d" % (len(samples) // 2))]
+            results.append((disk['mnt_point'], hours, perfdata))
+        if not results:
+            return ('UNKNOWN', _("Unknown mounting point: %s") % statparam, [])
+
+        def message(hours):
+            if (hours == float('inf')):
+                return _("FS not filling up")
+            return _("FS full in %.1f hours") % hours
+
+        # Plugin output
+        return self.checkinstances(message, results, statparam, warning, critical, reverse = True)
+
+
+    def check_docker(self, responses, warning, critical, statparam):
+
+        # Get and eval the containers stat (all the containers in one response)
+        if 'getDocker' not in responses:
+            return ('UNKNOWN', _("Can not run the Glances method: getDocker"), [])
+        containers = self.index(responses, 'getDocker', 'name')
+        self.log(containers)
+        #~ If the CPU or the memory of a container > 70%, then status is set to "WARNING".
+        #~ If the CPU or the memory of a container > 90%, then status is set to "CRITICAL"
+        if (warning is None): warning = 70
+        if (critical is None): critical = 90
+        results = []
+        for container in self.selectinstances(containers, statparam):
+            # cpu: {total}, memory: {usage, limit} (or the flat keys of the newer Glances)
+            cpu = container.get('cpu_percent', (container.get('cpu') or {}).get('total')) or 0
+            memory = container.get('memory') or {}
+            usage = container.get('memory_usage', memory.get('usage')) or 0
+            limit = memory.get('limit') or container.get('memory_limit')
+            mem = 100.0 * usage / limit if limit else 0.0
+            checked_value = max(cpu, mem)
+            # Performance data
+            perfdata = self.perfdata('docker', {'cpu': cpu, 'mem': mem, 'mem_usage': usage,
+                                                'mem_limit': limit},
+                                     {'cpu': (warning, critical), 'mem': (warning, critical)})
+            results.append((container['name'], checked_value, perfdata))
+        if not results:
+            return ('UNKNOWN', _("Unknown container: %s") % statparam, [])
+        # Plugin output
+        return self.checkinstances(_("Container CPU or memory: %d%%"), results, statparam,
+                                   warning, critical)
+
+
+def iterjsonarray(chunks):
+    """
+    Yield the items of a JSON array of objects read by chunks
+    Only one item at a time is decoded, the array is never in memory
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r,"
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while (pos < len(buffer)) and (buffer[pos] in whitespace):
+                pos += 1
+            if (pos == len(buffer)):
+                break
+            if not started:
+                if (buffer[pos] != "["):
+                    raise ValueError("Not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if (buffer[pos] == "]"):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # Incomplete item: wait for the next chunk
+                break
+            yield item
+        buffer = buffer[pos:]
+    if buffer.strip():
+        raise ValueError("Truncated JSON array")
+
+
+def percentile(ordered, p):
+    """
+    p-th percentile of the sorted values, linear interpolation between
+    the closest ranks (as numpy.percentile)
+    """
+    rank = p / 100.0 * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
 
 
-        elif (args['stat'] == "swap"):
+def corestats(values, threshold, vectorize = True):
+    """
+    Summary of the per core values: {'cores', 'max', 'argmax', 'mean', 'p50',
+    'p95', 'above' (cores >= threshold), 'imbalance' (max - mean)}
+    vectorize: one NumPy pass over an array of the values if NumPy is
+    installed, else the array module and one sort
+    """
+    numpy = None
+    if vectorize:
+        try:
+            import numpy
+        except ImportError:
+            pass
+    if numpy is not None:
+        values = numpy.fromiter(values, numpy.float64)
+        argmax = int(values.argmax())
+        p50, p95 = numpy.percentile(values, (50, 95))
+        summary = {'max': float(values[argmax]), 'argmax': argmax, 'mean': float(values.mean()),
+                   'p50': float(p50), 'p95': float(p95),
+                   'above': int(numpy.count_nonzero(values >= threshold))}
+    else:
+        import array
+        import bisect
+        values = array.array('d', values)
+        argmax = max(xrange(len(values)), key = values.__getitem__)
+        ordered = sorted(values)
+        summary = {'max': values[argmax], 'argmax': argmax, 'mean': sum(values) / len(values),
+                   'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95),
+                   'above': len(ordered) - bisect.bisect_left(ordered, threshold)}
+    summary['cores'] = len(values)
+    summary['imbalance'] = summary['max'] - summary['mean']
+    return summary
+
+
+def quotehost(host):
+    """
+    Host name usable in a file name (urllib.quote is slow to import)
+    """
+    return "".join([c if (c.isalnum() or c in ".-_") else "%%%02X" % ord(c) for c in host])
+
+
+def makeprivatedir(path):
+    """
+    Create the directory path (mode 0700) if needed
+    Raise OSError if it is not a directory of the current user, closed to
+    the others (a directory created by another user in /tmp for example)
+    """
+    import stat
+    try:
+        os.makedirs(path, 0o700)
+    except OSError:
+        # Already there, or created by another check
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or (st.st_uid != os.getuid()) or (st.st_mode & 0o077):
+        raise OSError(_("%s is not a private directory") % path)
+
+
+def atomicwrite(path, data):
+    """
+    Write data in the file path: written in a temporary file of the same
+    directory, then renamed, so it is never read partially written
+    """
+    import tempfile
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path), prefix = ".")
+    try:
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+class responsecache(object):
+    """
+    Glances responses shared between concurrent checks (--cache-ttl)
+    One file per host, port and method, the file age is the response age
+    """
+
+    default_dir = os.path.join(os.environ.get("TMPDIR", "/tmp"), "checkglances-cache")
+
+    def __init__(self, ttl, path = default_dir, maxentries = 1000):
+        self.ttl = ttl
+        self.path = path
+        self.maxentries = maxentries
+        makeprivatedir(path)
+
+
+    def filename(self, host, port, method):
+        return os.path.join(self.path, "%s-%d.%s" % (
+            quotehost(host), int(port), method))
+
+
+    def lock(self, host, port):
+        """
+        Wait for the exclusive lock of the host, close the file to release it
+        """
+        import fcntl
+        f = os.fdopen(os.open(self.filename(host, port, "lock"),
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NOFOLLOW, 0o600), "a")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
 
-            # Get and eval MEM stat
+
+    def get(self, host, port, methods):
+        """
+        Return a dict {method: response} of the not expired responses
+        """
+        responses = {}
+        now = time.time()
+        for method in methods:
+            filename = self.filename(host, port, method)
             try:
-                swap = json.loads(gs.getMemSwap())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getMemSwap"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(swap)
-            #~ If memory is > 70%, then status is set to "WARNING".
-            #~ If memory is > 90%, then status is set to "CRITICAL"
-            if (warning is None): warning = 70
-            if (critical is None): critical = 90
-            checked_value = swap['percent']
-            # Plugin output
-            checked_message = _("SWAP consumption: %.2f%%") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in swap:
-                if (key == "min5"):
-                    checked_message += " '%s'=%.2f;%s;%s" % (key, swap[key], warning, critical)
-                else:
-                    checked_message += " '%s'=%.2f" % (key, swap[key])
+                if (now - os.stat(filename).st_mtime < self.ttl):
+                    with open(filename) as f:
+                        responses[method] = f.read()
+            except (IOError, OSError):
+                # Not in the cache
+                pass
+        return responses
 
 
-        elif (args['stat'] == "process"):
+    def put(self, host, port, responses):
+        """
+        Store the {method: response} dict
+        """
+        if not responses:
+            return
+        for method, response in responses.items():
+            # Readers do not take the lock
+            atomicwrite(self.filename(host, port, method), response)
+        self.evict()
 
-            # Get and eval Process stat
+
+    def evict(self):
+        """
+        Remove the expired responses, then the oldest ones over maxentries
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith(".") or name.endswith((".lock", ".metadata", ".breaker", ".history", ".rates")):
+                continue
+            filename = os.path.join(self.path, name)
             try:
-                process = json.loads(gs.getProcessCount())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getProcessCount"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(process)
-            #~ If running process is > 50, then status is set to "WARNING".
-            #~ If running process is > 100, then status is set to "CRITICAL"
-            if (warning is None): warning = 50
-            if (critical is None): critical = 100
-            checked_value = process['running']
-            # Plugin output
-            checked_message = _("Running processes: %d") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in process:
-                if (key == "min5"):
-                    checked_message += " '%s'=%.2f;%s;%s" % (key, process[key], warning, critical)
+                mtime = os.stat(filename).st_mtime
+                if (now - mtime >= self.ttl):
+                    os.unlink(filename)
                 else:
-                    checked_message += " '%s'=%.2f" % (key, process[key])
+                    entries.append((mtime, filename))
+            except OSError:
+                # Removed by another check
+                pass
+        if (len(entries) > self.maxentries):
+            entries.sort()
+            for mtime, filename in entries[:len(entries) - self.maxentries]:
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+
+
+class responserecorder(object):
+    """
+    Raw Glances responses of the checks kept on disk (--record) and
+    given back instead of asking the Glances servers (--replay)
+    One file per host, port and method: <host>-<port>.<method>.json,
+    gzip compressed (.json.gz) unless level is 0
+    """
 
+    # Size of the chunks of the replayed streamed responses
+    chunksize = 65536
 
-        elif (args['stat'] == "net"):
+    def __init__(self, path, level = 6):
+        self.path = path
+        self.level = level
 
-            # Get and eval Network stat
+
+    def filename(self, host, port, method, compressed):
+        return os.path.join(self.path, "%s-%d.%s.json%s" % (
+            quotehost(host), int(port), method, ".gz" if compressed else ""))
+
+
+    def save(self, host, port, responses):
+        """
+        Write the {method: response} dict, the streamed responses are read
+        Return the responses to check (the streamed ones read again by chunks)
+        """
+        import zlib
+        if not os.path.isdir(self.path):
             try:
-                net = json.loads(gs.getNetwork())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getNetwork"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(net)
-            #~ If net[param] > 60 Mbps, then status is set to "WARNING".
-            #~ If net[param] > 80 Mbps, then status is set to "CRITICAL"
-            # Values are in Kbyte/second
-            if (warning is None): warning = 7500000
-            if (critical is None): critical = 10000000
-            checked_value = -1
-            for interface in net:
-                if interface['interface_name'] == args['statparam']:
-                    checked_value = max(interface["tx"], interface["rx"])
-                    break
-            if (checked_value == -1):
-                print(_("Unknown network interface: %s") % args['statparam'])
-                self.exit('UNKNOWN')
-            # Plugin output
-            checked_message = _("Network rate: %d") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in interface:
-                checked_message += " '%s'=%s" % (key, interface[key])
+                os.makedirs(self.path)
+            except OSError:
+                # Created by another check
+                pass
+        for method, response in responses.items():
+            if not isinstance(response, basestring):
+                response = "".join(response)
+                responses[method] = self.chunks(response)
+            if isinstance(response, unicode):
+                response = response.encode('utf-8')
+            if (self.level > 0):
+                compress = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                response = compress.compress(response) + compress.flush()
+            # A replay never reads a partial response
+            atomicwrite(self.filename(host, port, method, self.level > 0), response)
+        return responses
+
+
+    def chunks(self, data):
+        for i in range(0, len(data), self.chunksize):
+            yield data[i:i + self.chunksize]
+
+
+    def load(self, host, port, methods, streamedmethods = ()):
+        """
+        Return the {method: response} dict of the recorded methods,
+        the streamed methods as iterators on the chunks of the response
+        """
+        import zlib
+        responses = {}
+        for method in methods:
+            for compressed in (True, False):
+                try:
+                    with open(self.filename(host, port, method, compressed), "rb") as f:
+                        data = f.read()
+                except IOError:
+                    continue
+                if compressed:
+                    data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+                responses[method] = self.chunks(data) if (method in streamedmethods) else data
+                break
+        return responses
+
+
+class metadatacache(object):
+    """
+    Static metadata of the Glances servers (see nagiosplugin.discover())
+    One JSON file per host and port in the cache directory
+    """
 
+    def __init__(self, ttl, path = responsecache.default_dir):
+        self.ttl = ttl
+        self.path = path
+        makeprivatedir(path)
 
-        elif (args['stat'] == "diskio"):
 
-            # Get and eval Network stat
+    def filename(self, host, port):
+        return os.path.join(self.path, "%s-%d.metadata" % (quotehost(host), int(port)))
 
-            try:
-                diskio = json.loads(gs.getDiskIO())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getDiskIO"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(diskio)
-
-            #~ If diskio[param] > 30 Mbytes/sec, then status is set to "WARNING".
-            #~ If diskio[param] > 40 MBytes/sec, then status is set to "CRITICAL"
-            if (warning is None): warning = 30000000
-            if (critical is None): critical = 40000000
-            checked_value = -1
-            for disk in diskio:
-                if disk['disk_name'] == args['statparam']:
-                    # checked_value = max(disk["read_bytes"], disk["write_bytes"])
-                    checked_value = disk["read_bytes"]
-                    break
-            if (checked_value == -1):
-                print(_("Unknown disk: %s") % args['statparam'])
-                self.exit('UNKNOWN')
-            # Plugin output
-            checked_message = _("Disk IO: %d") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in disk:
-                if (key == "read_bytes"):
-                    checked_message += " '%s'=%.2f;%s;%s" % (key, disk[key], warning, critical)
-                elif (key == "write_bytes"):
-                    checked_message += " '%s'=%.2f" % (key, disk[key])
-                elif (key == "time_since_update"):
-                    checked_message += " '%s'=%.2f" % (key, disk[key])
 
+    def get(self, host, port):
+        """
+        Return the metadata dict of the server, empty if unknown or expired
+        """
+        filename = self.filename(host, port)
+        try:
+            if (time.time() - os.stat(filename).st_mtime < self.ttl):
+                with open(filename) as f:
+                    return json.load(f)
+        except (IOError, OSError, ValueError):
+            # Unknown server or bad formed file
+            pass
+        return {}
+
+
+    def put(self, host, port, metadata):
+        atomicwrite(self.filename(host, port), json.dumps(metadata))
+
+
+    def invalidate(self, host, port):
+        try:
+            os.unlink(self.filename(host, port))
+        except OSError:
+            pass
+
+
+class circuitbreaker(object):
+    """
+    Failures of the Glances servers (--breaker-failures)
+    After failures consecutive failures, the server is not asked during
+    cooldown seconds, then tried again (once, until it answers)
+    One JSON file per host and port in the cache directory
+    """
+
+    def __init__(self, failures = 3, cooldown = 60, path = responsecache.default_dir):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.path = path
+        makeprivatedir(path)
 
-        elif (args['stat'] == "fs"):
 
-            # Get and eval Network stat
+    def filename(self, host, port):
+        return os.path.join(self.path, "%s-%d.breaker" % (quotehost(host), int(port)))
 
+
+    def get(self, host, port):
+        """
+        Return the {'failures': n, 'until': time} state of the server
+        (until: end of the cool-down period), None if it did not fail
+        """
+        try:
+            with open(self.filename(host, port)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+
+    def wait(self, state):
+        """
+        Return the seconds left before the server can be asked again
+        """
+        if (state is None) or (state.get('failures', 0) < self.failures):
+            return 0
+        return max(0, state.get('until', 0) - time.time())
+
+
+    def failure(self, host, port, state):
+        state = dict(state or {})
+        state['failures'] = state.get('failures', 0) + 1
+        state['until'] = time.time() + self.cooldown
+        try:
+            atomicwrite(self.filename(host, port), json.dumps(state))
+        except OSError:
+            pass
+
+
+    def success(self, host, port):
+        try:
+            os.unlink(self.filename(host, port))
+        except OSError:
+            pass
+
+
+class metrichistory(object):
+    """
+    Metrics history of the Glances servers (--history)
+    One ring buffer of samples per host, port and metric: a memory mapped
+    file of the cache directory, a header then (time, value) doubles
+    Appending a sample writes 16 bytes and the header, the samples are
+    read as an array of doubles without parsing
+    """
+
+    magic = 'CGH1'
+    # magic, capacity (samples), count (samples), next (index)
+    header = '=4sIII'
+
+    def __init__(self, samples = 1024, path = responsecache.default_dir):
+        self.samples = samples
+        self.path = path
+        makeprivatedir(path)
+
+
+    def filename(self, host, port, metric):
+        return os.path.join(self.path, "%s-%d.%s.history" % (
+            quotehost(host), int(port), quotehost(metric)))
+
+
+    def append(self, host, port, metric, value, now = None):
+        """
+        Add a sample of the metric (at time now, default: the current time)
+        Return the samples, an array of (time, value) doubles
+        (oldest first while the buffer is not full, then in ring order)
+        """
+        import array
+        import fcntl
+        import mmap
+        import struct
+        headersize = struct.calcsize(self.header)
+        size = headersize + 16 * self.samples
+        fd = os.open(self.filename(host, port, metric), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Concurrent checks of the same metric: one at a time
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if (os.fstat(fd).st_size != size):
+                # New history, or new --history size: start again
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            buf = mmap.mmap(fd, size)
             try:
-                fs = json.loads(gs.getFs())
-            except xmlrpclib.Fault as err:
-                print(_("Can not run the Glances method: getFs"))
-                self.exit('UNKNOWN')
-            else:
-                self.log(fs)
-            #~ If fs[param] > %, then status is set to "WARNING".
-            #~ If fs[param] > %, then status is set to "CRITICAL"
-            if (warning is None): warning = 70
-            if (critical is None): critical = 90
-            checked_value = -1
-            for disk in fs:
-                mnt_point = args['statparam']
-                # If the FS looks like it is a Windows drive, automatically add the Windows slash
-                if not args['statparam'].startswith("/") and not args['statparam'].endswith("\\"):
-                        mnt_point = args['statparam'].replace(":",":\\")
-                if disk['mnt_point'] == mnt_point:
-                    checked_value = disk["percent"]
-                    break
-            if (checked_value == -1):
-                print(_("Unknown mounting point: %s") % args['statparam'])
-                self.exit('UNKNOWN')
-            # Plugin output
-            checked_message = _("FS using space: %d%%") % checked_value
-            # Performance data
-            checked_message += _(" |")
-            for key in disk:
-                checked_message += " '%s'=%s" % (key, disk[key])
-            checked_message += " 'pctfree'=%s%%;%s;%s;0;100" % (checked_value,warning,critical)
+                magic, capacity, count, index = struct.unpack_from(self.header, buf, 0)
+                if (magic != self.magic) or (capacity != self.samples):
+                    capacity, count, index = self.samples, 0, 0
+                struct.pack_into('=dd', buf, headersize + 16 * index,
+                                 time.time() if now is None else now, value)
+                count = min(count + 1, capacity)
+                struct.pack_into(self.header, buf, 0, self.magic, capacity, count,
+                                 (index + 1) % capacity)
+                samples = array.array('d')
+                samples.fromstring(buf[headersize:headersize + 16 * count])
+            finally:
+                buf.close()
+        finally:
+            # Also releases the lock
+            os.close(fd)
+        return samples
+
+
+    def forecast(self, samples, limit):
+        """
+        Return the hours before the metric reaches limit, from the least
+        squares line of the (time, value) samples, infinite if not growing
+        """
+        times = samples[0::2]
+        values = samples[1::2]
+        n = len(values)
+        if (n < 2):
+            return float('inf')
+        meantime = sum(times) / n
+        meanvalue = sum(values) / n
+        stt = stv = 0.0
+        for t, v in zip(times, values):
+            stt += (t - meantime) * (t - meantime)
+            stv += (t - meantime) * (v - meanvalue)
+        if (stt == 0) or (stv <= 0):
+            return float('inf')
+        slope = stv / stt
+        # Value of the line at the last sample
+        value = meanvalue + slope * (max(times) - meantime)
+        return max(0.0, (limit - value) / slope / 3600)
+
+
+class counterstate(object):
+    """
+    Last reading of the cumulative counters of the instances (--rates)
+    One tiny file per host, port and instance in the cache directory:
+    one fixed size record, read and written in place under a lock
+    """
+
+    magic = 'CGR1'
+    # magic, time of the reading, the in and out counters (rx/tx, read/write)
+    record = '=4sdQQ'
+
+    def __init__(self, path = responsecache.default_dir):
+        self.path = path
+        makeprivatedir(path)
+
+
+    def filename(self, host, port, instance):
+        return os.path.join(self.path, "%s-%d.%s.rates" % (
+            quotehost(host), int(port), quotehost(instance)))
+
+
+    def rates(self, host, port, instance, counters, now = None):
+        """
+        Keep the (in, out) counters read at time now (default: the current time)
+        Return the per second rates since the previous reading, None if there
+        is no previous reading or if a counter has been reset
+        """
+        import fcntl
+        import struct
+        if now is None:
+            now = time.time()
+        size = struct.calcsize(self.record)
+        counters = [int(c) for c in counters]
+        fd = os.open(self.filename(host, port, instance), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Concurrent checks of the same instance: one at a time
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, size)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, struct.pack(self.record, self.magic, now, *counters))
+        finally:
+            # Also releases the lock
+            os.close(fd)
+        if (len(data) != size):
+            return None
+        magic, then, previousin, previousout = struct.unpack(self.record, data)
+        if (magic != self.magic) or (now <= then) or \
+           (counters[0] < previousin) or (counters[1] < previousout):
+            return None
+        return [(counters[0] - previousin) / (now - then), (counters[1] - previousout) / (now - then)]
+
+
+class connectionpool(object):
+    """
+    Idle XML-RPC proxies to the Glances servers, shared between threads
+    One proxy is only used by one check at a time
+    """
+
+    def __init__(self, maxidle = 8):
+        import threading
+        self.maxidle = maxidle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        with self.lock:
+            if self.idle.get(key):
+                return self.idle[key].pop()
+        return None
+
+
+    def put(self, key, gs):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if (len(idle) < self.maxidle):
+                idle.append(gs)
+
+
+class threadedstdout(object):
+    """
+    sys.stdout replacement sending the writes of each thread
+    to its own buffer (the plugin prints its output)
+    """
+
+    def __init__(self, stdout):
+        import threading
+        self.stdout = stdout
+        self.local = threading.local()
+
+
+    def capture(self):
+        import StringIO
+        self.local.buffer = StringIO.StringIO()
+
+
+    def release(self):
+        output = self.local.buffer.getvalue()
+        del self.local.buffer
+        return output
 
 
+    def write(self, data):
+        getattr(self.local, 'buffer', self.stdout).write(data)
+
+
+    def flush(self):
+        getattr(self.local, 'buffer', self.stdout).flush()
+
+
+def capture(function, *args, **kwargs):
+    """
+    Run a function printing its result and calling exit() (main, check...)
+    Thread safe, return a (return code, output) tuple
+    """
+    if not isinstance(sys.stdout, threadedstdout):
+        sys.stdout = threadedstdout(sys.stdout)
+    sys.stdout.capture()
+    code = nagiosplugin.return_codes['UNKNOWN']
+    try:
+        function(*args, **kwargs)
+    except SystemExit as err:
+        code = err.code if isinstance(err.code, int) else code
+    except Exception as err:
+        print(_("Check failed: %s") % err)
+    return (code, sys.stdout.release())
+
+
+class passiveresults(object):
+    """
+    Write check results as Nagios/Shinken passive check results
+    commandfile: external command file (PROCESS_SERVICE_CHECK_RESULT)
+    checkresultsdir: check results spool directory
+    Default: external commands on stdout
+    """
+
+    def __init__(self, commandfile = None, checkresultsdir = None):
+        self.commandfile = commandfile
+        self.checkresultsdir = checkresultsdir
+
+
+    def write(self, results):
+        """
+        results: list of (host, service, return code, output, start, finish) tuples
+        """
+        if self.checkresultsdir is not None:
+            self.writecheckresults(results)
         else:
+            self.writecommands(results)
 
-            # Else...
 
-            print(_("Unknown stat: %s") % args['stat'])
-            self.exit('UNKNOWN')
+    def escape(self, output):
+        # One line per result, the multiline output is escaped
+        return output.strip().replace("\n", "\\n")
 
-        # Display the message
-        self.log(_("Warning threshold: %s" % warning))
-        self.log(_("Critical threshold: %s" % critical))
-        print(checked_message)
 
-        # Return code
-        if (checked_value < warning):
-            self.exit('OK')
-        elif (checked_value < critical):
-            self.exit('WARNING')
-        elif (checked_value < critical):
-            self.exit('CRITICAL')
+    def writecommands(self, results):
+        lines = ["[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (
+                    finish, host, service, code, self.escape(output))
+                 for host, service, code, output, start, finish in results]
+        if self.commandfile is None:
+            sys.stdout.write("".join(lines))
+            return
+        # The command file is a FIFO: one write per line (atomic up to PIPE_BUF)
+        f = open(self.commandfile, "a")
+        try:
+            for line in lines:
+                f.write(line)
+                f.flush()
+        finally:
+            f.close()
+
+
+    def writecheckresults(self, results):
+        now = time.time()
+        content = ["### Passive Check Result File ###\n",
+                   "file_time=%d\n\n" % now]
+        for host, service, code, output, start, finish in results:
+            content.append("### Nagios Service Check Result ###\n"
+                           "# Time: %s\n"
+                           "host_name=%s\n"
+                           "service_description=%s\n"
+                           "check_type=1\n"
+                           "check_options=0\n"
+                           "scheduled_check=0\n"
+                           "reschedule_check=0\n"
+                           "latency=0.0\n"
+                           "start_time=%f\n"
+                           "finish_time=%f\n"
+                           "early_timeout=0\n"
+                           "exited_ok=1\n"
+                           "return_code=%d\n"
+                           "output=%s\n\n" % (
+                               time.ctime(finish), host, service, start,
+                               finish, code, self.escape(output)))
+        # Nagios reads the result file once the .ok file exists
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix = "c", dir = self.checkresultsdir)
+        try:
+            os.write(fd, "".join(content))
+        finally:
+            os.close(fd)
+        os.chmod(path, 0o644)
+        open(path + ".ok", "w").close()
+
+
+class checkdaemon(object):
+    """
+    Long-running checkglances answering checks on a Unix socket
+    Connections to the Glances servers are kept between the checks
+    Request: the command line arguments separated by NUL
+    Response: the return code on the first line, then the plugin output
+    """
+
+    # In a private directory: a client only talks to a daemon of its user
+    default_socket = os.path.join(os.environ.get("XDG_RUNTIME_DIR")
+                                  or "/tmp/checkglances-%d" % os.getuid(), "checkglances.sock")
+    # Checks run at the same time, the next clients wait in the listen backlog
+    maxclients = 64
+    # Time given to a client to send its request and read the response (seconds)
+    clienttimeout = 60
+
+    def __init__(self, path = default_socket):
+        import threading
+        self.path = path
+        self.pool = connectionpool()
+        self.clients = threading.BoundedSemaphore(self.maxclients)
+        if (path == self.default_socket):
+            makeprivatedir(os.path.dirname(path))
+        if os.path.exists(path):
+            os.unlink(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            self.socket.bind(path)
+        finally:
+            os.umask(umask)
+        self.socket.listen(128)
+        sys.stdout = threadedstdout(sys.stdout)
+
+
+    def check(self, argv):
+        """
+        Run main() on argv, return a (return code, output) tuple
+        """
+        plugin = nagiosplugin(pool = self.pool)
+        try:
+            return capture(main, argv, plugin)
+        finally:
+            plugin.release()
+
+
+    def handle(self, conn):
+        """
+        Run one check for the client (one thread per client)
+        """
+        try:
+            conn.settimeout(self.clienttimeout)
+            request = []
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                request.append(data)
+            code, output = self.check([a for a in "".join(request).split("\0") if a != ""])
+            conn.sendall("%d\n%s" % (code, output))
+        except socket.error:
+            # Client gone, or too slow
+            pass
+        finally:
+            conn.close()
+            self.clients.release()
+
+
+    def serve(self):
+        import signal
+        import threading
+        sys.stderr.write(_("%s daemon listening on %s") % (__appname__, self.path) + "\n")
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                self.clients.acquire()
+                conn, address = self.socket.accept()
+                thread = threading.Thread(target = self.handle, args = (conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.socket.close()
+            os.unlink(self.path)
+
+
+class metricsexporter(object):
+    """
+    Prometheus exporter (--exporter): the hosts are polled in the
+    background every interval seconds, /metrics is answered from the
+    exposition text of the last poll (rendered when the metrics change)
+    The metrics are the perfdata of the checks: glances_<stat>_<label>
+    {host, instance}, glances_check_status (return code) and glances_up
+    """
+
+    default_listen = ":9209"
+    default_stats = "cpu,load,mem,swap,net,diskio,fs"
+
+    def __init__(self, plugin, hosts, stats, port, password = "", interval = 15, workers = 16):
+        self.plugin = plugin
+        if plugin.pool is None:
+            plugin.pool = connectionpool()
+        self.hosts = hosts
+        self.stats = stats
+        self.port = port
+        self.password = password
+        self.interval = interval
+        self.workers = workers
+        # {host: [(metric, labels, value)]} of the last poll
+        self.samples = {}
+        # Exposition text and its gzip encoding
+        self.text = ""
+        self.gzipped = None
+
+
+    def metric(self, name):
+        return "glances_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+    def poll(self, host):
+        """
+        Check all the stats of host, return its [(metric, labels, value)]
+        """
+        plugin = self.plugin.worker()
+        start = time.time()
+        try:
+            responses = plugin.grab(host, self.stats, port = self.port, password = self.password,
+                                    stat = ",".join([s for s, p in self.stats]))
+            if isinstance(responses, checkresult):
+                plugin.log(_("%s: %s") % (host, responses.message))
+                return [("glances_up", (("host", host),), 0)]
+            samples = [("glances_up", (("host", host),), 1)]
+            for stat, param in self.stats:
+                # One check per instance (net, diskio, fs): unprefixed perfdata
+                instances = [""]
+                if stat in plugin.statsinstances:
+                    method, key = plugin.statsinstances[stat]
+                    if method not in responses:
+                        continue
+                    if stat in ('fs', 'fsforecast'):
+                        param = plugin.mountpoint(param)
+                    instances = plugin.selectinstances(plugin.index(responses, method, key), param)
+                    instances = [i[key] for i in instances]
+                for instance in instances:
+                    labels = (("host", host),)
+                    if (instance != ""):
+                        labels += (("instance", instance),)
+                    status, message, perfdata = plugin.checkstat(
+                        stat, instance or param, responses, None, None)
+                    samples.append(("glances_check_status", labels + (("stat", stat),),
+                                    plugin.return_codes[status]))
+                    for label, value in perfdata:
+                        value = plugin.perfvalue(value)
+                        if value is not None:
+                            samples.append((self.metric("%s_%s" % (stat, label)), labels, value))
+            return samples
+        except Exception as err:
+            plugin.log(_("Can not poll %s: %s") % (host, err))
+            return [("glances_up", (("host", host),), 0)]
+        finally:
+            plugin.release()
+            plugin.log(_("Host %s polled in %.3f seconds") % (host, time.time() - start))
+
+
+    def render(self):
+        """
+        Render the exposition text of the samples
+        """
+        families = {}
+        for samples in self.samples.values():
+            for metric, labels, value in samples:
+                families.setdefault(metric, []).append((labels, value))
+        lines = []
+        for metric in sorted(families):
+            lines.append("# TYPE %s gauge\n" % metric)
+            for labels, value in sorted(families[metric]):
+                lines.append("%s{%s} %s\n" % (metric, ",".join(
+                    ['%s="%s"' % (name, unicode(label).replace("\\", "\\\\").replace('"', '\\"')
+                                  .replace("\n", "\\n")) for name, label in labels]),
+                    repr(value)))
+        text = "".join(lines).encode('utf-8')
+        import zlib
+        compress = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        # Swapped at once: the scrapes read the text or the previous one
+        self.text, self.gzipped = text, compress.compress(text) + compress.flush()
+
+
+    def pollloop(self):
+        import multiprocessing.pool
+        pool = multiprocessing.pool.ThreadPool(max(1, min(self.workers, len(self.hosts))))
+        while True:
+            start = time.time()
+            changed = False
+            for host, samples in zip(self.hosts, pool.map(self.poll, self.hosts)):
+                if (self.samples.get(host) != samples):
+                    self.samples[host] = samples
+                    changed = True
+            if changed:
+                self.render()
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+
+    def serve(self, listen = default_listen):
+        import threading
+        import BaseHTTPServer
+        import SocketServer
+        exporter = self
+
+        class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if (self.path.split("?")[0] != "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.text
+                gzipped = exporter.gzipped
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                if (gzipped is not None) and ("gzip" in (self.headers.get("Accept-Encoding") or "")):
+                    body = gzipped
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                exporter.plugin.log(format % args)
+
+        class server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        address, sep, port = listen.rpartition(":")
+        httpd = server((address, int(port)), handler)
+        thread = threading.Thread(target = self.pollloop)
+        thread.daemon = True
+        thread.start()
+        sys.stderr.write(_("%s exporter listening on %s") % (__appname__, listen) + "\n")
+        httpd.serve_forever()
+
+
+class metricspusher(object):
+    """
+    Push the perfdata of the checks to a time series database (--push):
+    InfluxDB line protocol or Graphite plaintext
+    The lines of all the stats and hosts are buffered and sent by batches
+    (batch bytes, maxage seconds, at exit) over one connection kept open,
+    or appended to a spool file
+    target: tcp://host:port, udp://host:port or the spool file path
+    """
+
+    formats = ('influx', 'graphite')
+    # Largest UDP datagram
+    datagram = 8192
+    # Pushers of the process by (target, format, batch), the daemon checks share them
+    pushers = {}
+
+    def __init__(self, target, format = 'influx', batch = 65536, maxage = 10, timeout = 5):
+        import threading
+        if format not in self.formats:
+            raise ValueError(_("Unknown format: %s") % format)
+        self.target = target
+        self.format = format
+        self.protocol, sep, address = target.partition("://")
+        if not sep:
+            self.protocol, self.address = 'file', target
+        elif self.protocol in ('tcp', 'udp'):
+            host, sep, port = address.rpartition(":")
+            if not (sep and host and port.isdigit()):
+                raise ValueError(_("Use %s://<host>:<port>") % self.protocol)
+            self.address = (host.strip("[]"), int(port))
+        else:
+            raise ValueError(_("Unknown protocol: %s") % self.protocol)
+        self.batch = batch
+        self.maxage = maxage
+        self.timeout = timeout
+        self.socket = None
+        # Encoded lines not sent yet, their size and the time of the first one
+        self.lines = []
+        self.size = 0
+        self.oldest = None
+        # Last send error (None once sent)
+        self.error = None
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def get(cls, target, format = 'influx', batch = 65536):
+        """
+        Return the pusher of the process for target, flushed at exit
+        """
+        key = (target, format, batch)
+        if key not in cls.pushers:
+            pusher = cls(target, format, batch)
+            if (cls.pushers.setdefault(key, pusher) is pusher):
+                import atexit
+                atexit.register(pusher.close)
+        return cls.pushers[key]
+
+
+    def influx(self, host, stat, instance, values, now):
+        def escape(name):
+            return re.sub(r"([, =])", r"\\\1", name)
+        tags = ",host=" + escape(host)
+        if (instance != ""):
+            tags += ",instance=" + escape(instance)
+        return ["glances_%s%s %s %d\n" % (stat, tags, ",".join(["%s=%r" % (escape(label), value)
+                                                               for label, value in values]),
+                                         now * 1e9)]
+
+
+    def graphite(self, host, stat, instance, values, now):
+        def escape(name):
+            return re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+        path = "glances.%s.%s." % (escape(host), stat)
+        if (instance != ""):
+            path += escape(instance) + "."
+        return ["%s%s %r %d\n" % (path, escape(label), value, now) for label, value in values]
+
+
+    def add(self, host, series, now = None):
+        """
+        Buffer the [(stat, instance, [(label, value)])] series of host,
+        send the buffer once it is larger than batch or older than maxage
+        """
+        if now is None:
+            now = time.time()
+        lines = []
+        for stat, instance, values in series:
+            lines += [line.encode('utf-8') if isinstance(line, unicode) else line
+                      for line in getattr(self, self.format)(host, stat, instance, values, now)]
+        with self.lock:
+            if self.oldest is None:
+                self.oldest = monotonic()
+            self.lines += lines
+            self.size += sum([len(line) for line in lines])
+            full = (self.size >= self.batch) or (monotonic() - self.oldest >= self.maxage)
+        if full:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Send the buffered lines, kept for the next flush if they can not be sent
+        """
+        with self.lock:
+            if not self.lines:
+                return
+            try:
+                self.send(self.lines)
+            except (socket.error, IOError, OSError) as err:
+                self.error = err
+                # Not more than 16 batches kept, the oldest lines first dropped
+                while (self.size > 16 * self.batch):
+                    self.size -= len(self.lines.pop(0))
+                self.oldest = monotonic()
+                return
+            self.lines = []
+            self.size = 0
+            self.oldest = None
+            self.error = None
+
+
+    def connect(self):
+        if self.socket is None:
+            if (self.protocol == 'tcp'):
+                self.socket = socket.create_connection(self.address, self.timeout)
+            else:
+                family, type, proto, name, address = socket.getaddrinfo(
+                    self.address[0], self.address[1], 0, socket.SOCK_DGRAM)[0]
+                self.socket = socket.socket(family, socket.SOCK_DGRAM)
+                self.socket.connect(address)
+        return self.socket
+
+
+    def send(self, lines):
+        if (self.protocol == 'file'):
+            # One write in append mode: the batches of concurrent checks are not mixed
+            fd = os.open(self.address, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, "".join(lines))
+            finally:
+                os.close(fd)
+            return
+        if (self.protocol == 'udp'):
+            # As few datagrams as possible, whole lines only
+            packets = [""]
+            for line in lines:
+                if packets[-1] and (len(packets[-1]) + len(line) > self.datagram):
+                    packets.append("")
+                packets[-1] += line
+        else:
+            packets = ["".join(lines)]
+        # The connection closed by the server is opened again once
+        for retry in (False, True):
+            try:
+                for packet in packets:
+                    self.connect().sendall(packet)
+                return
+            except socket.error:
+                if self.socket is not None:
+                    self.socket.close()
+                    self.socket = None
+                if retry or (self.protocol == 'udp'):
+                    raise
+
+
+    def close(self):
+        self.flush()
+        if self.error is not None:
+            sys.stderr.write(_("Can not push the metrics to %s: %s") % (self.target, self.error) + "\n")
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
 
 
 # Main function
 ###############
 
-def main():
+def main(argv = None, plugin = None):
 
     # Create an instance of the your plugin
-    plugin = nagiosplugin()
+    if plugin is None:
+        plugin = nagiosplugin()
+    if argv is None:
+        argv = sys.argv[1:]
 
     # Manage command line arguments
-    if len(sys.argv) < 2:
+    if len(argv) < 1:
         plugin.syntax()
         plugin.exit('UNKNOWN')
 
     try:
         # Add optional tag definition here
         # ...
-        opts, args = getopt.getopt(sys.argv[1:], "VhvH:p:P:w:c:s:e:")
+        opts, args = getopt.getopt(argv, "VhvH:p:P:w:c:s:e:", ["daemon", "socket=",
+                                    "command-file=", "checkresults-dir=",
+                                    "service=", "workers=",
+                                    "cache-ttl=", "cache-dir=", "cache-size=",
+                                    "metadata-ttl=", "connect-timeout=",
+                                    "timeout=", "no-gzip", "api=",
+                                    "api-version=", "timings", "timing-log=",
+                                    "profile", "deadline=", "breaker-failures=",
+                                    "breaker-cooldown=", "history=", "exporter",
+                                    "listen=", "interval=", "samples=", "statistic=", "push=", "push-format=",
+                                    "push-batch=", "record=", "record-level=", "replay=",
+                                    "perfdata-keys=", "rates"])
     except getopt.GetoptError, err:
         plugin.syntax()
         plugin.exit('UNKNOWN')
@@ -524,9 +3085,40 @@ def main():
     # Default parameters
     warning = None
     critical = None
-    port = 61209
+    port = None
     password = ""
     statparam = ""
+    daemon = False
+    socketpath = checkdaemon.default_socket
+    commandfile = None
+    checkresultsdir = None
+    service = None
+    workers = 16
+    cachettl = 0
+    cachedir = responsecache.default_dir
+    cachesize = 1000
+    metadatattl = 3600
+    profiling = False
+    breakerfailures = 3
+    breakercooldown = 60
+    historysize = 1024
+    exporter = False
+    listen = metricsexporter.default_listen
+    interval = None
+    push = None
+    pushformat = 'influx'
+    pushbatch = 65536
+    recordlevel = 6
+
+    def number(opt, arg, kind = int):
+        """
+        Value of a numeric option, UNKNOWN usage message if not a number
+        """
+        try:
+            return kind(arg)
+        except ValueError:
+            print(_("Use %s with a number") % opt)
+            plugin.exit('UNKNOWN')
 
     for opt, arg in opts:
         # Standard tag definition
@@ -553,11 +3145,134 @@ def main():
             stat = arg
         elif opt in ("-e", "--statparam"):
             statparam = arg
+        elif opt == "--daemon":
+            daemon = True
+        elif opt == "--socket":
+            socketpath = arg
+        elif opt == "--command-file":
+            commandfile = arg
+        elif opt == "--checkresults-dir":
+            checkresultsdir = arg
+        elif opt == "--service":
+            service = arg
+        elif opt == "--workers":
+            workers = number(opt, arg)
+        elif opt == "--cache-ttl":
+            cachettl = number(opt, arg, float)
+        elif opt == "--cache-dir":
+            cachedir = arg
+        elif opt == "--cache-size":
+            cachesize = number(opt, arg)
+        elif opt == "--metadata-ttl":
+            metadatattl = number(opt, arg, float)
+        elif opt == "--connect-timeout":
+            plugin.connecttimeout = number(opt, arg, float)
+        elif opt == "--timeout":
+            plugin.readtimeout = number(opt, arg, float)
+        elif opt == "--no-gzip":
+            plugin.gzip = False
+        elif opt == "--api":
+            plugin.api = arg
+        elif opt == "--api-version":
+            plugin.apiversion = number(opt, arg)
+        elif opt == "--timings":
+            plugin.timings = True
+        elif opt == "--timing-log":
+            plugin.timinglog = arg
+        elif opt == "--profile":
+            profiling = True
+        elif opt == "--deadline":
+            plugin.deadline = number(opt, arg, float)
+        elif opt == "--breaker-failures":
+            breakerfailures = number(opt, arg)
+        elif opt == "--breaker-cooldown":
+            breakercooldown = number(opt, arg, float)
+        elif opt == "--history":
+            historysize = number(opt, arg)
+        elif opt == "--exporter":
+            exporter = True
+        elif opt == "--listen":
+            listen = arg
+        elif opt == "--interval":
+            interval = number(opt, arg, float)
+        elif opt == "--samples":
+            plugin.samples = number(opt, arg)
+        elif opt == "--statistic":
+            plugin.statistic = arg
+        elif opt == "--push":
+            push = arg
+        elif opt == "--push-format":
+            pushformat = arg
+        elif opt == "--push-batch":
+            pushbatch = number(opt, arg)
+        elif opt == "--record":
+            plugin.record = responserecorder(arg)
+        elif opt == "--record-level":
+            recordlevel = number(opt, arg)
+        elif opt == "--replay":
+            plugin.replay = responserecorder(arg)
+        elif opt == "--rates":
+            plugin.userates = True
+        elif opt == "--perfdata-keys":
+            plugin.perfdatakeys = [k.strip() for k in arg.split(",") if k.strip() != ""]
         else:
             # Tag is UNKNOW
             plugin.syntax()
             plugin.exit('UNKNOWN')
 
+    if plugin.api not in ('xmlrpc', 'rest'):
+        print(_("Use --api with value in xmlrpc, rest"))
+        plugin.exit('UNKNOWN')
+    if port is None:
+        port = 61208 if (plugin.api == 'rest') else 61209
+    else:
+        port = number("-p", port)
+    if plugin.statistic not in plugin.statistics:
+        print(_("Use --statistic with value in %s") % ", ".join(plugin.statistics))
+        plugin.exit('UNKNOWN')
+    if (plugin.samples < 1):
+        print(_("Use --samples with a value of 1 or more"))
+        plugin.exit('UNKNOWN')
+    if (interval is not None) and (interval <= 0):
+        print(_("Use --interval with a positive number of seconds"))
+        plugin.exit('UNKNOWN')
+    if (interval is not None) and not exporter:
+        plugin.interval = interval
+    if plugin.record is not None:
+        plugin.record.level = recordlevel
+
+    # A check sent to the daemon only runs checks
+    if (plugin.pool is not None) and (daemon or exporter or profiling):
+        print(_("Use --daemon, --exporter and --profile without the daemon"))
+        plugin.exit('UNKNOWN')
+
+    # Same run under the profiler (without --profile or its abbreviations)
+    if profiling:
+        return profile(main, [a for a in argv if not ((len(a) > 2) and "--profile".startswith(a))],
+                       plugin)
+
+    # Daemon mode (not from a check sent to the daemon)
+    if daemon and (plugin.pool is None):
+        try:
+            server = checkdaemon(socketpath)
+        except (OSError, socket.error) as err:
+            print(_("Can not listen on %s: %s") % (socketpath, err))
+            plugin.exit('UNKNOWN')
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+        plugin.exit('OK')
+
+    # Prometheus exporter: the default stats, all their instances
+    if exporter:
+        try:
+            stat
+        except NameError:
+            stat = metricsexporter.default_stats
+        if (statparam == ""):
+            statparam = "*"
+
     # Check args
     try:
         host
@@ -570,25 +3285,126 @@ def main():
         print(_("You need to specify the stat to grab (use the -s tag)"))
         plugin.exit('UNKNOWN')
     else:
-        if stat not in plugin.statslist:
-            print(_("Use -s with value in %s") % ", ".join(plugin.statslist))
-            plugin.exit('UNKNOWN')
-        if (stat == "net") and (statparam == ""):
-            print(_("You need to specify the interface name with -e <interface>"))
-            plugin.exit('UNKNOWN')
-        if (stat == "diskio") and (statparam == ""):
-            print(_("You need to specify the disk name with -e <disk>"))
+        stats = plugin.parsestats(stat, statparam)
+        if not stats:
+            print(_("You need to specify the stat to grab (use the -s tag)"))
             plugin.exit('UNKNOWN')
-        if (stat == "fs") and (statparam == ""):
-            print(_("You need to specify the mounting point with -e <fs>"))
+        for s, param in stats:
+            if s not in plugin.statslist:
+                print(_("Use -s with value in %s") % ", ".join(plugin.statslist))
+                plugin.exit('UNKNOWN')
+            if (s == "net") and (param == ""):
+                print(_("You need to specify the interface name with -e <interface>"))
+                plugin.exit('UNKNOWN')
+            if (s == "diskio") and (param == ""):
+                print(_("You need to specify the disk name with -e <disk>"))
+                plugin.exit('UNKNOWN')
+            if s in ("fs", "fsforecast") and (param == ""):
+                print(_("You need to specify the mounting point with -e <fs>"))
+                plugin.exit('UNKNOWN')
+            if (s == "topproc") and (param.partition(":")[0] not in ('',) + plugin.topprockeys):
+                print(_("Use -e with value in %s (and :<number of processes>)")
+                      % ", ".join(plugin.topprockeys))
+                plugin.exit('UNKNOWN')
+        # Thresholds: a number, or one per stat (empty for the default)
+        for option, value in (("-w", warning), ("-c", critical)):
+            if value is None:
+                continue
+            for item in (value.split(",") if (len(stats) > 1) else [value]):
+                try:
+                    if (item != "") or (len(stats) == 1):
+                        float(item)
+                except ValueError:
+                    print(_("Use %s with a number (comma separated numbers for several stats)")
+                          % option)
+                    plugin.exit('UNKNOWN')
+
+
+    # Glances responses and servers state shared between checks
+    try:
+        if (cachettl > 0):
+            plugin.cache = responsecache(cachettl, cachedir, cachesize)
+        if (metadatattl > 0):
+            plugin.metadata = metadatacache(metadatattl, cachedir)
+        if (breakerfailures > 0):
+            plugin.breaker = circuitbreaker(breakerfailures, breakercooldown, cachedir)
+        if (historysize > 0):
+            plugin.history = metrichistory(historysize, cachedir)
+        if plugin.userates:
+            plugin.rates = counterstate(cachedir)
+    except OSError as err:
+        # Not shared with the other users: the checks needing it are UNKNOWN
+        plugin.cacheerror = str(err)
+        plugin.log(_("Cache directory disabled: %s") % err)
+    if push is not None:
+        try:
+            plugin.push = metricspusher.get(push, pushformat, pushbatch)
+        except ValueError as err:
+            print(_("Can not push the metrics to %s: %s") % (push, err))
             plugin.exit('UNKNOWN')
 
+    # Several hosts: passive check results
+    try:
+        hosts = plugin.parsehosts(host)
+    except IOError as err:
+        print(_("Can not read the hosts file: %s") % err)
+        plugin.exit('UNKNOWN')
+
+    # Prometheus exporter: the polls of a host never last more than the interval
+    if exporter:
+        if interval is None:
+            interval = 15
+        if plugin.deadline is None:
+            plugin.deadline = interval
+        try:
+            metricsexporter(plugin, hosts, stats, port, password, interval, workers).serve(listen)
+        except KeyboardInterrupt:
+            pass
+        plugin.exit('OK')
+    if (len(hosts) != 1) or commandfile or checkresultsdir:
+        results = plugin.checkhosts(hosts, warning, critical, workers = workers,
+                                    service = service, port = port,
+                                    password = password, stat = stat,
+                                    statparam = statparam)
+        try:
+            passiveresults(commandfile, checkresultsdir).write(results)
+        except (IOError, OSError) as err:
+            print(_("Can not write the check results: %s") % err)
+            plugin.exit('UNKNOWN')
+        plugin.exit('OK')
 
     # Do the check
-    plugin.check(host, warning, critical, port = port, password = password, \
+    plugin.check(hosts[0], warning, critical, port = port, password = password, \
                  stat = stat, statparam = statparam)
 
 
+def profile(function, *args, **kwargs):
+    """
+    Run function under cProfile (and tracemalloc, if available)
+    and print the hot spots on stderr
+    """
+    import cProfile
+    import pstats
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start(10)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        sys.stdout.flush()
+        pstats.Stats(profiler, stream = sys.stderr).sort_stats('cumulative').print_stats(30)
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            sys.stderr.write(_("Top memory allocations:") + "\n")
+            for statistic in snapshot.statistics('lineno')[:15]:
+                sys.stderr.write("%s\n" % statistic)
+
+
 # Main program
 ##############
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# CheckGlances client
+# Send a check to a running "checkglances.py --daemon"
+#
+# Copyright (C) Nicolargo 2012 <nicolas@nicolargo.com>
+#
+# This script is distributed
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This script is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.";
+#
+# Same command line, output and return code than checkglances.py:
+#   checkglances_client.py -H <host> -s <stat> [-e <param>] -w <warning> -c <critical>
+# The daemon socket is set with CHECKGLANCES_SOCKET (default
+# $XDG_RUNTIME_DIR/checkglances.sock or /tmp/checkglances-<uid>/checkglances.sock)
+# If the daemon is not running, or not run by the same user, the check is
+# done by this process
+#
+
+# Only import what is needed to talk to the daemon: this script is started
+# for every check, the heavy work is done by the daemon
+import os
+import sys
+import socket
+
+
+def fallback(argv):
+    """
+    No daemon: run the plugin in this process (same contract)
+    Imported as a module, the plugin is compiled once (checkglances.pyc)
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import checkglances
+    checkglances.main(argv)
+
+
+def peeruid(s, path):
+    """
+    User of the daemon: the credentials of the peer on Linux,
+    the owner of the socket file elsewhere
+    """
+    if sys.platform.startswith("linux"):
+        import struct
+        # pid, uid, gid (SO_PEERCRED is missing from the Python 2 socket module)
+        creds = s.getsockopt(socket.SOL_SOCKET, getattr(socket, "SO_PEERCRED", 17),
+                             struct.calcsize("3i"))
+        return struct.unpack("3i", creds)[1]
+    return os.lstat(path).st_uid
+
+
+def main(argv):
+    path = os.environ.get("CHECKGLANCES_SOCKET") or os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR") or "/tmp/checkglances-%d" % os.getuid(),
+        "checkglances.sock")
+    try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(path)
+        # The arguments (passwords) are only sent to a daemon of this user
+        if (peeruid(s, path) != os.getuid()):
+            s.close()
+            return fallback(argv)
+    except (socket.error, OSError):
+        return fallback(argv)
+
+    s.sendall("\0".join(argv) + "\0")
+    s.shutdown(socket.SHUT_WR)
+    response = []
+    while True:
+        data = s.recv(65536)
+        if not data:
+            break
+        response.append(data)
+    s.close()
+
+    code, sep, output = "".join(response).partition("\n")
+    if not sep:
+        print("Bad formed response from the CheckGlances daemon")
+        sys.exit(3)
+    sys.stdout.write(output)
+    sys.exit(int(code))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])